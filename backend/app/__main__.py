@@ -0,0 +1,22 @@
+import os
+
+import uvicorn
+
+# Uvicorn worker processes; each worker has its own thread pool of THREAD_POOL_SIZE
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# The server is started from this package entry point rather than from
+# app.main, so child processes (uvicorn workers, frame decode workers) never
+# re-import the application as their __main__ module
+if __name__ == "__main__":
+    # Auto-reload watches every file, so only enable it for local development
+    reload = os.getenv("ENV", "development").lower() == "development"
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=9091,
+        reload=reload,
+        workers=None if reload else WEB_CONCURRENCY,
+        loop="uvloop",  # uvloop and httptools ship with uvicorn[standard]
+        http="httptools",
+    )
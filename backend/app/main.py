@@ -1,51 +1,87 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
-import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+
+# Logging is configured here, by the application, before any app module is
+# imported, so messages logged while services initialize at import are kept
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
 
 from app.routes.library import library_router
 from app.routes.llms import llm_router
 from app.routes.media import media_router
 from app.routes.search import search_router
 from app.routes.summarization import summarization_router
-from app.routes.transcription import executor, transcription_router
+from app.routes.transcription import transcription_router
 from app.services.background_processor import background_processor
-from app.services.transcription import get_model, model_cache
+from app.services.executors import default_executor, search_executor
+from app.services.llms import llm_service
+from app.services.search import search_service
+from app.services.transcription import PRELOAD_MODELS, model_cache, warm_up_model
+from app.services.trash import empty_trash, reap_trash
 from app.services.video_library import video_library_service
+from app.services.visual_processing import visual_processing_service
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    Load default model into memory on startup, start background processor,
+    Load and warm up models on startup, start background processor,
     and clean up on shutdown.
     """
-    logger.info("Loading default model...")
-    try:
-        get_model()
-    except Exception as e:
-        logger.error(f"Error loading model: {e}")
-        raise RuntimeError(f"Model loading failed: {e}")
+    # Share one pool for asyncio.to_thread and run_in_executor(None, ...)
+    asyncio.get_running_loop().set_default_executor(default_executor)
+
+    logger.info(f"Loading Whisper models: {', '.join(PRELOAD_MODELS)}...")
+
+    def warm_up_whisper():
+        for model_name in PRELOAD_MODELS:
+            warm_up_model(model_name)
+
+    # Whisper, SigLIP, the text embedder and the LLM chat tokenizer warm up
+    # concurrently; only a Whisper failure aborts startup
+    whisper_result, visual_result, search_result, llm_result = await asyncio.gather(
+        asyncio.to_thread(warm_up_whisper),
+        visual_processing_service.warm_up(),
+        search_service.warm_up(),
+        llm_service.warm_up(),
+        return_exceptions=True,
+    )
+    if isinstance(whisper_result, BaseException):
+        logger.error(f"Error loading model: {whisper_result}")
+        raise RuntimeError(f"Model loading failed: {whisper_result}")
+    if isinstance(visual_result, BaseException):
+        logger.warning(f"SigLIP warm-up failed, first visual request will be slower: {visual_result}")
+    if isinstance(search_result, BaseException):
+        logger.warning(f"Embedding model warm-up failed, first search will be slower: {search_result}")
+    if isinstance(llm_result, BaseException):
+        logger.warning(f"LLM warm-up failed, batched answers use plain prompts: {llm_result}")
+
+    # Deleted temp files are moved to trash directories and removed here
+    trash_reaper = asyncio.create_task(reap_trash())
 
     # Start background processor
     logger.info("Starting background processor...")
     await background_processor.start()
 
-    # Resume any pending or processing videos
-    pending_videos = video_library_service.get_pending_videos()
+    # Resume any pending or processing videos, from one worker only
+    pending_videos = (
+        video_library_service.get_pending_videos()
+        if background_processor.claim_resume()
+        else []
+    )
     if pending_videos:
         logger.info(f"Resuming {len(pending_videos)} pending videos...")
-        for video in pending_videos:
-            await background_processor.enqueue(video.id)
+        background_processor.resume([video.id for video in pending_videos])
 
     yield
 
@@ -53,8 +89,13 @@ async def lifespan(app: FastAPI):
     logger.info("Stopping background processor...")
     await background_processor.stop()
 
+    trash_reaper.cancel()
+    await asyncio.gather(trash_reaper, return_exceptions=True)
+    await asyncio.to_thread(empty_trash)
+
     logger.info("Shutting down thread pool executor...")
-    executor.shutdown(wait=True)
+    default_executor.shutdown(wait=True)
+    search_executor.shutdown(wait=True)
 
     logger.info("Unloading models...")
     model_cache.clear()
@@ -62,7 +103,11 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down...")
 
 
-app = FastAPI(title="Video search and transcription API", lifespan=lifespan)
+app = FastAPI(
+    title="Video search and transcription API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -78,6 +123,3 @@ app.include_router(llm_router, prefix="/llms")
 app.include_router(summarization_router, prefix="/summarize")
 app.include_router(media_router, prefix="/media")
 app.include_router(library_router, prefix="/library")
-
-if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=9091, reload=True)
@@ -24,6 +24,8 @@ class VideoMetadata(CamelCaseModel):
     title: str
     source: VideoSource
     file_path: str  # Path to stored video file
+    content_type: Optional[str] = None  # MIME type of the video file
+    files_present: bool = False  # Whether the video file has been stored on disk
     youtube_url: Optional[str] = None  # Original YouTube URL if source is YOUTUBE
     duration: Optional[float] = None  # Duration in seconds
     thumbnail_path: Optional[str] = None
@@ -1,57 +1,53 @@
+import asyncio
 import logging
 import os
 import shutil
-from typing import Optional
+from typing import Iterator, Optional
 
+import orjson
 from fastapi import APIRouter, File, Form, HTTPException, UploadFile, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from app.models.video import (
     AddVideosResponse,
     AddVideoResponse,
     AddYouTubeVideoRequest,
     ProcessingStatusResponse,
-    TranscriptSegmentResponse,
     VideoDetailResponse,
     VideoLibraryResponse,
     VideoMetadata,
     VideoTranscriptResponse,
 )
-from app.services.background_processor import background_processor
+from app.services.background_processor import ENQUEUE_TIMEOUT, background_processor
 from app.services.search import search_service
 from app.services.video_library import video_library_service
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 library_router = APIRouter()
 
-ALLOWED_VIDEO_TYPES = [
-    "video/mp4",
-    "video/avi",
-    "video/mov",
-    "video/quicktime",
-    "video/x-msvideo",
-    "video/x-matroska",
-    "video/mkv",
-    "video/webm",
-]
+ALLOWED_VIDEO_TYPES = frozenset(
+    {
+        "video/mp4",
+        "video/avi",
+        "video/mov",
+        "video/quicktime",
+        "video/x-msvideo",
+        "video/x-matroska",
+        "video/mkv",
+        "video/webm",
+    }
+)
 
 
 @library_router.get("/videos", response_model=VideoLibraryResponse)
 async def get_video_library():
     """Get all videos in the library."""
     videos = video_library_service.get_all_videos()
-    processing_count = len(
-        [v for v in videos if v.status.value in ["pending", "processing"]]
-    )
 
     return VideoLibraryResponse(
         videos=videos,
-        processing_count=processing_count,
+        processing_count=video_library_service.get_processing_count(),
         total_count=len(videos),
     )
 
@@ -60,11 +56,18 @@ async def get_video_library():
 async def get_videos_grouped():
     """Get videos grouped by source (YouTube vs Uploaded)."""
     grouped = video_library_service.get_videos_by_source()
-    return {
-        "groups": [
-            {"name": name, "videos": videos} for name, videos in grouped.items()
-        ]
-    }
+    # orjson encodes datetimes and enums itself, so skip jsonable_encoder
+    return ORJSONResponse(
+        content={
+            "groups": [
+                {
+                    "name": name,
+                    "videos": [video.model_dump(by_alias=True) for video in videos],
+                }
+                for name, videos in grouped.items()
+            ]
+        }
+    )
 
 
 @library_router.get("/videos/{video_id}", response_model=VideoDetailResponse)
@@ -80,13 +83,7 @@ async def get_video(video_id: str):
     transcript_text = None
     segment_count = 0
     try:
-        transcript_text = search_service.get_transcript_text_by_video_id(video_id)
-        if transcript_text:
-            # Count segments by querying the collection
-            results = search_service._collection.get(
-                where={"video_id": video_id}
-            )
-            segment_count = len(results.get("documents", []))
+        transcript_text, segment_count = search_service.get_transcript_summary(video_id)
     except Exception as e:
         logger.warning(f"Could not get transcript for video {video_id}: {e}")
 
@@ -107,30 +104,9 @@ async def get_video_transcript(video_id: str):
         )
 
     try:
-        results = search_service._collection.get(where={"video_id": video_id})
-
-        if not results or not results["documents"]:
-            return VideoTranscriptResponse(
-                video_id=video_id, video_title=video.title, segments=[]
-            )
-
-        # Build segments from results
-        segments = []
-        for i, doc in enumerate(results["documents"]):
-            metadata = results["metadatas"][i]
-            segments.append(
-                TranscriptSegmentResponse(
-                    segment_id=metadata["id"],
-                    start_time=metadata["start_time"],
-                    end_time=metadata["end_time"],
-                    text=doc,
-                )
-            )
-
-        # Sort by start time
-        segments.sort(key=lambda s: s.start_time)
+        segments = list(search_service.iter_segments_ordered(video_id))
 
-        return VideoTranscriptResponse(
+        return VideoTranscriptResponse.model_construct(
             video_id=video_id, video_title=video.title, segments=segments
         )
 
@@ -142,18 +118,49 @@ async def get_video_transcript(video_id: str):
         )
 
 
+@library_router.get("/videos/{video_id}/transcript/stream")
+async def stream_video_transcript(video_id: str):
+    """
+    Stream transcript segments for a specific video as NDJSON, one segment per line.
+
+    Intended for very long transcripts, where building the full response would
+    hold every segment in memory at once.
+    """
+    video = video_library_service.get_video(video_id)
+    if not video:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Video not found"
+        )
+
+    def ndjson_lines() -> Iterator[bytes]:
+        for segment in search_service.iter_segments_ordered(video_id):
+            yield orjson.dumps(segment.model_dump(by_alias=True)) + b"\n"
+
+    # Sync iterators are consumed in the threadpool, off the event loop
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
 @library_router.post("/videos/youtube", response_model=AddVideoResponse)
 async def add_youtube_video(request: AddYouTubeVideoRequest):
     """Add a YouTube video to the library."""
     logger.info(f"Adding YouTube video: {request.url} with model: {request.model}")
 
     try:
-        response = video_library_service.add_youtube_video(str(request.url), request.model)
+        # yt-dlp looks up the title, so keep it off the event loop
+        response = await asyncio.to_thread(
+            video_library_service.add_youtube_video, str(request.url), request.model
+        )
 
         # Enqueue for background processing
-        await background_processor.enqueue(response.video_id)
+        await background_processor.enqueue(response.video_id, timeout=ENQUEUE_TIMEOUT)
 
         return response
+    except asyncio.TimeoutError:
+        logger.warning(f"Processing queue full, video left pending: {request.url}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Processing queue is full. The video was saved as pending, retry later.",
+        )
     except Exception as e:
         logger.error(f"Error adding YouTube video: {e}")
         raise HTTPException(
@@ -185,20 +192,28 @@ async def upload_videos(
                 )
                 continue
 
-            # Read file content
-            content = await file.read()
-
-            # Add to library
-            response = video_library_service.add_uploaded_video(
-                file.filename or "video.mp4", content, model
+            # Stream the spooled upload to the library without reading it into memory
+            response = await asyncio.to_thread(
+                video_library_service.add_uploaded_video,
+                file.filename or "video.mp4",
+                file.file,
+                model,
             )
             added.append(response)
 
             # Enqueue for background processing
-            await background_processor.enqueue(response.video_id)
+            await background_processor.enqueue(response.video_id, timeout=ENQUEUE_TIMEOUT)
 
             logger.info(f"Added video: {file.filename} ({response.video_id})")
 
+        except asyncio.TimeoutError:
+            logger.warning(f"Processing queue full, video left pending: {file.filename}")
+            errors.append(
+                {
+                    "filename": file.filename,
+                    "error": "Processing queue is full. The video was saved as pending, retry later.",
+                }
+            )
         except Exception as e:
             logger.error(f"Error uploading {file.filename}: {e}")
             errors.append({"filename": file.filename, "error": str(e)})
@@ -215,15 +230,15 @@ async def delete_video(video_id: str):
             status_code=status.HTTP_404_NOT_FOUND, detail="Video not found"
         )
 
-    # Delete from ChromaDB
+    # Delete transcript segments and visual embeddings from ChromaDB concurrently
     try:
-        # Delete transcript segments
-        search_service._collection.delete(where={"video_id": video_id})
-        logger.info(f"Deleted transcript segments for video {video_id}")
-
-        # Delete visual embeddings
-        search_service._visual_collection.delete(where={"video_id": video_id})
-        logger.info(f"Deleted visual embeddings for video {video_id}")
+        await asyncio.gather(
+            asyncio.to_thread(search_service.delete_transcript, video_id),
+            asyncio.to_thread(
+                search_service._visual_collection.delete, where={"video_id": video_id}
+            ),
+        )
+        logger.info(f"Deleted transcript segments and visual embeddings for video {video_id}")
     except Exception as e:
         logger.error(f"Error deleting from ChromaDB: {e}")
 
@@ -268,7 +283,13 @@ async def retry_video(video_id: str):
     from app.models.video import ProcessingStatus
 
     video_library_service.update_video_status(video_id, ProcessingStatus.PENDING)
-    await background_processor.enqueue(video_id)
+    try:
+        await background_processor.enqueue(video_id, timeout=ENQUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Processing queue is full, retry later.",
+        )
 
     return {"message": "Video re-queued for processing", "video_id": video_id}
 
@@ -278,24 +299,19 @@ async def clear_library():
     """Clear all videos from the library and clean up all associated data."""
     logger.info("Clearing entire video library")
 
-    # Clear ChromaDB collections
+    # Clear ChromaDB collections concurrently
     try:
-        # Get all unique transcript IDs from the collection
-        all_results = search_service._collection.get()
-        if all_results and all_results["ids"]:
-            search_service._collection.delete(ids=all_results["ids"])
-            logger.info(f"Deleted {len(all_results['ids'])} transcript segments from ChromaDB")
-
-        # Clear visual embeddings
-        all_visual = search_service._visual_collection.get()
-        if all_visual and all_visual["ids"]:
-            search_service._visual_collection.delete(ids=all_visual["ids"])
-            logger.info(f"Deleted {len(all_visual['ids'])} visual embeddings from ChromaDB")
+        deleted_segments, visual_count = await asyncio.gather(
+            asyncio.to_thread(search_service.clear_transcripts),
+            asyncio.to_thread(search_service.clear_visual_embeddings),
+        )
+        logger.info(f"Deleted {deleted_segments} transcript segments from ChromaDB")
+        logger.info(f"Deleted {visual_count} visual embeddings from ChromaDB")
     except Exception as e:
         logger.error(f"Error clearing ChromaDB: {e}")
 
     # Clear video library (files and metadata)
-    result = video_library_service.clear_library()
+    result = await asyncio.to_thread(video_library_service.clear_library)
 
     return {
         "message": "Library cleared successfully",
@@ -1,39 +1,82 @@
+import asyncio
 import logging
-import mimetypes
 import os
-from typing import Generator
 
-from fastapi import APIRouter, HTTPException, Request, status
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import FileResponse, ORJSONResponse, Response
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
 
-from app.services.video_library import video_library_service
+from app.services.video_library import DEFAULT_CONTENT_TYPE, video_library_service
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 media_router = APIRouter()
 
 TEMP_DIR = os.getenv("TMPDIR", "/tmp")
-CHUNK_SIZE = 1024 * 1024  # 1MB chunks for streaming
+CHUNK_SIZE = 4 * 1024 * 1024  # 4MB chunks for streaming
+NOT_MODIFIED_HEADERS = ("etag", "last-modified", "cache-control")
 
 
-def ranged_file_reader(
-    file_path: str, start: int, end: int, chunk_size: int = CHUNK_SIZE
-) -> Generator[bytes, None, None]:
-    """Generator that yields chunks of a file for range requests."""
-    with open(file_path, "rb") as f:
-        f.seek(start)
-        remaining = end - start + 1
-        while remaining > 0:
-            chunk = f.read(min(chunk_size, remaining))
-            if not chunk:
-                break
-            remaining -= len(chunk)
-            yield chunk
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag (weak comparison)."""
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+class MediaFileResponse(FileResponse):
+    """
+    FileResponse that answers 404 if the file is gone when the response is sent,
+    and 304 if the client already holds the current version.
+
+    The routes trust stored paths instead of checking the disk on every
+    request; the single stat happens here, where it is needed anyway. The
+    ETag derived from that stat (size and mtime) lets conditional requests
+    skip the body entirely.
+    """
+
+    def __init__(self, *args, not_found_detail: str = "File not found", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.not_found_detail = not_found_detail
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            try:
+                self.stat_result = await asyncio.to_thread(os.stat, self.path)
+            except FileNotFoundError:
+                logger.warning(f"File not found: {self.path}")
+                response = ORJSONResponse(
+                    {"detail": self.not_found_detail},
+                    status_code=status.HTTP_404_NOT_FOUND,
+                )
+                await response(scope, receive, send)
+                return
+            self.set_stat_headers(self.stat_result)
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        etag = self.headers.get("etag")
+        if if_none_match and etag and etag_matches(if_none_match, etag):
+            headers = {
+                key: value
+                for key, value in self.headers.items()
+                if key in NOT_MODIFIED_HEADERS
+            }
+            response = Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            await response(scope, receive, send)
+            return
+
+        await super().__call__(scope, receive, send)
+
+
+class VideoFileResponse(MediaFileResponse):
+    """
+    FileResponse with larger read chunks for video playback.
+
+    Starlette answers Range requests natively and uses zero-copy sends when the
+    ASGI server supports them, so seeking needs no hand-rolled range reader.
+    """
+
+    chunk_size = CHUNK_SIZE
 
 
 @media_router.get("/audio/{filename}")
@@ -43,14 +86,10 @@ async def get_audio(filename: str):
     """
     audio_path = os.path.join(TEMP_DIR, filename)
 
-    if not os.path.exists(audio_path):
-        logger.warning(f"Audio file not found: {audio_path}")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Audio file not found"
-        )
-
     logger.info(f"Serving audio file: {audio_path}")
-    return FileResponse(audio_path, media_type="audio/mpeg")
+    return MediaFileResponse(
+        audio_path, media_type="audio/mpeg", not_found_detail="Audio file not found"
+    )
 
 
 @media_router.get("/frames/{video_id}/{filename}")
@@ -67,22 +106,17 @@ async def get_frame(video_id: str, filename: str):
     # Frames are stored in data/frames/{video_id}/{filename}
     frame_path = os.path.join("data/frames", video_id, filename)
 
-    if not os.path.exists(frame_path):
-        logger.warning(f"Frame file not found: {frame_path}")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Frame file not found"
-        )
-
     logger.info(f"Serving frame file: {frame_path}")
-    return FileResponse(
+    return MediaFileResponse(
         frame_path,
         media_type="image/jpeg",
-        headers={"Cache-Control": "public, max-age=86400"}  # Cache for 1 day
+        headers={"Cache-Control": "public, max-age=86400"},  # Cache for 1 day
+        not_found_detail="Frame file not found",
     )
 
 
 @media_router.get("/video/{video_id}")
-async def stream_video(video_id: str, request: Request):
+async def stream_video(video_id: str):
     """
     Stream a video file with range request support for seeking.
     """
@@ -93,69 +127,20 @@ async def stream_video(video_id: str, request: Request):
         )
 
     file_path = video.file_path
-    if not os.path.exists(file_path):
+    if not video.files_present:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Video file not found on disk",
         )
 
-    file_size = os.path.getsize(file_path)
-
-    # Determine content type
-    content_type, _ = mimetypes.guess_type(file_path)
-    if not content_type:
-        content_type = "video/mp4"
-
-    # Check for range header
-    range_header = request.headers.get("range")
-
-    if range_header:
-        # Parse range header (e.g., "bytes=0-1023")
-        try:
-            range_spec = range_header.replace("bytes=", "")
-            range_parts = range_spec.split("-")
-            start = int(range_parts[0]) if range_parts[0] else 0
-            end = int(range_parts[1]) if range_parts[1] else file_size - 1
-        except (ValueError, IndexError):
-            raise HTTPException(
-                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
-                detail="Invalid range header",
-            )
-
-        # Validate range
-        if start >= file_size or end >= file_size or start > end:
-            raise HTTPException(
-                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
-                detail="Range not satisfiable",
-            )
-
-        content_length = end - start + 1
-
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(content_length),
-            "Content-Type": content_type,
-        }
-
-        return StreamingResponse(
-            ranged_file_reader(file_path, start, end),
-            status_code=status.HTTP_206_PARTIAL_CONTENT,
-            headers=headers,
-            media_type=content_type,
-        )
-    else:
-        # No range header - return full file
-        headers = {
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(file_size),
-        }
-
-        return FileResponse(
-            file_path,
-            media_type=content_type,
-            headers=headers,
-        )
+    content_type = video.content_type or DEFAULT_CONTENT_TYPE
+
+    # Range headers (e.g., "bytes=0-1023") are parsed and validated by the response
+    return VideoFileResponse(
+        file_path,
+        media_type=content_type,
+        not_found_detail="Video file not found on disk",
+    )
 
 
 @media_router.get("/thumbnail/{video_id}")
@@ -169,13 +154,14 @@ async def get_thumbnail(video_id: str):
             status_code=status.HTTP_404_NOT_FOUND, detail="Video not found"
         )
 
-    if not video.thumbnail_path or not os.path.exists(video.thumbnail_path):
+    if not video.thumbnail_path:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Thumbnail not found"
         )
 
-    return FileResponse(
+    return MediaFileResponse(
         video.thumbnail_path,
         media_type="image/jpeg",
         headers={"Cache-Control": "public, max-age=86400"},
+        not_found_detail="Thumbnail not found",
     )
\ No newline at end of file
@@ -21,7 +21,7 @@ async def query_transcript(request: QuestionRequest):
         search_type: The type of search to perform (keyword, semantic, llm, visual)
     """
     try:
-        response = search_service.query_transcript(
+        response = await search_service.aquery_transcript(
             question=request.question,
             video_ids=request.video_ids,
             top_k=request.top_k,
@@ -1,22 +1,14 @@
 import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter, HTTPException
 
 from app.services.summarization import summarize_by_video_id
 from app.models.summarization import SummarizationRequest, SummarizationResponse
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 summarization_router = APIRouter()
 
-executor = ThreadPoolExecutor(max_workers=2)
-
 
 @summarization_router.post("/transcript", response_model=SummarizationResponse)
 async def summarize_transcript(request: SummarizationRequest):
@@ -29,11 +21,7 @@ async def summarize_transcript(request: SummarizationRequest):
 
     logger.info("Starting summarization...")
     try:
-        summary = await asyncio.get_event_loop().run_in_executor(
-            executor,
-            summarize_by_video_id,
-            request.video_id,
-        )
+        summary = await asyncio.to_thread(summarize_by_video_id, request.video_id)
         if summary is None:
             raise HTTPException(
                 status_code=404,
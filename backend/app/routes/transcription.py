@@ -1,4 +1,3 @@
-from concurrent.futures import ThreadPoolExecutor
 from fastapi import (
     APIRouter,
     BackgroundTasks,
@@ -29,21 +28,36 @@ from app.services.transcription import (
     cleanup_frames_directory,
 )
 from app.services.search import search_service
-from app.services.visual_processing import visual_processing_service
+from app.services.trash import discard_file, register_trash_dir
+from app.services.video_library import UPLOAD_CHUNK_SIZE
+from app.services.visual_indexing import index_video_frames
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 transcription_router = APIRouter()
 
-# Thread pool for CPU-bound operations
-executor = ThreadPoolExecutor(max_workers=4)
-
 TEMP_DIR = os.getenv("TMPDIR", "/tmp")
+register_trash_dir(TEMP_DIR)
+# Largest video accepted by the direct transcription upload, matching the frontend check
+MAX_UPLOAD_SIZE_MB = int(os.getenv("MAX_UPLOAD_SIZE_MB", "50"))
+
+ALLOWED_TYPES = frozenset(
+    {
+        "video/mp4",
+        "video/avi",
+        "video/mov",
+        "video/quicktime",
+        "video/x-msvideo",
+        "video/mkv",
+        "video/webm",
+    }
+)
+
+
+def _save_upload(file_obj, path: str) -> None:
+    """Copy an uploaded file to disk; opening and closing block too, so this runs in a thread."""
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file_obj, f, UPLOAD_CHUNK_SIZE)
 
 
 @transcription_router.post("/video-url", response_model=TranscriptionResponse)
@@ -68,9 +82,7 @@ async def transcribe_video_url(
     try:
         logger.info(f"Processing video from URL: {request.video_url}")
 
-        result = await asyncio.get_event_loop().run_in_executor(
-            executor,
-            process_video_from_url,
+        result = await process_video_from_url(
             str(request.video_url),
             video_path,
             audio_path,
@@ -79,75 +91,26 @@ async def transcribe_video_url(
         )
 
         transcript_text = result["text"]
+        # Whisper output is trusted, so segments are built without validation
+        id_prefix = f"{id}_"
         segments = [
-            TranscriptSegment(
-                id=f"{id}_{i}", start=seg["start"], end=seg["end"], text=seg["text"]
+            TranscriptSegment.model_construct(
+                id=id_prefix + str(i), start=seg["start"], end=seg["end"], text=seg["text"]
             )
             for i, seg in enumerate(result["segments"])
         ]
 
-        # Index text transcript
-        search_service.index_transcript(
-            Transcript(id=id, text=transcript_text, segments=segments)
+        # Index the transcript while frames are extracted and embedded
+        await asyncio.gather(
+            asyncio.to_thread(
+                search_service.index_transcript,
+                Transcript(id=id, text=transcript_text, segments=segments),
+            ),
+            index_video_frames(id, video_path, segments),
         )
 
-        # Process visual information
-        try:
-            logger.info(f"Starting visual processing for transcript {id}")
-
-            # Extract frames for each segment
-            frames_by_segment = await asyncio.get_event_loop().run_in_executor(
-                executor,
-                visual_processing_service.extract_frames_for_segments,
-                video_path,
-                segments,
-                0.5,  # Extract 1 frame every 2 seconds
-            )
-
-            # Generate embeddings for all frames
-            all_frame_paths = []
-            frame_segment_mapping = {}
-
-            for segment_id, frames in frames_by_segment.items():
-                for frame in frames:
-                    all_frame_paths.append(frame["path"])
-                    frame_segment_mapping[frame["path"]] = (
-                        segment_id,
-                        frame["timestamp"],
-                    )
-
-            if all_frame_paths:
-                embeddings = await asyncio.get_event_loop().run_in_executor(
-                    executor,
-                    visual_processing_service.generate_frame_embeddings,
-                    all_frame_paths,
-                )
-
-                # Prepare frame data with embeddings
-                frame_data_with_embeddings = {}
-                for i, frame_path in enumerate(all_frame_paths):
-                    segment_id, timestamp = frame_segment_mapping[frame_path]
-                    if segment_id not in frame_data_with_embeddings:
-                        frame_data_with_embeddings[segment_id] = []
-                    frame_data_with_embeddings[segment_id].append(
-                        {
-                            "timestamp": timestamp,
-                            "path": frame_path,
-                            "embedding": embeddings[i],
-                        }
-                    )
-
-                # Index visual embeddings
-                search_service.index_visual_embeddings(id, frame_data_with_embeddings)
-                logger.info(f"Visual processing completed for transcript {id}")
-
-        except Exception as e:
-            logger.error(f"Error during visual processing: {e}")
-            # Continue even if visual processing fails
-
         # Clean up the video file after visual processing
-        if os.path.exists(video_path):
-            os.remove(video_path)
+        if discard_file(video_path):
             logger.info(f"Deleted video file: {video_path}")
 
         # Add a background task to clean up the audio file after a delay of 1 hour
@@ -170,8 +133,6 @@ async def transcribe_video_url(
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
-
-
 @transcription_router.post("/video-file", response_model=TranscriptionResponse)
 async def transcribe_video_file(
     video_file: UploadFile = File(...),
@@ -194,31 +155,26 @@ async def transcribe_video_file(
 
     try:
         # Validate file type
-        allowed_types = [
-            "video/mp4",
-            "video/avi",
-            "video/mov",
-            "video/quicktime",
-            "video/x-msvideo",
-            "video/mkv",
-            "video/webm",
-        ]
-        if video_file.content_type not in allowed_types:
+        if video_file.content_type not in ALLOWED_TYPES:
             raise HTTPException(
                 status_code=400,
                 detail=f"Unsupported file type: {video_file.content_type}. Supported types: MP4, AVI, MOV, MKV, WebM",
             )
 
-        # Save uploaded file temporarily
-        with open(video_path, "wb") as temp_file:
-            shutil.copyfileobj(video_file.file, temp_file)
+        # Starlette records the size while parsing the upload, so no seek is needed
+        if video_file.size is not None and video_file.size > MAX_UPLOAD_SIZE_MB * 1024 * 1024:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large. Maximum upload size is {MAX_UPLOAD_SIZE_MB}MB",
+            )
+
+        # Save uploaded file temporarily, off the event loop
+        await asyncio.to_thread(_save_upload, video_file.file, video_path)
 
         logger.info(f"Processing uploaded video file: {video_file.filename}")
 
         # Process the video file (extract audio and transcribe)
-        result = await asyncio.get_event_loop().run_in_executor(
-            executor,
-            process_video_from_file,
+        result = await process_video_from_file(
             video_path,
             audio_path,
             model or "small",
@@ -226,75 +182,26 @@ async def transcribe_video_file(
         )
 
         transcript_text = result["text"]
+        # Whisper output is trusted, so segments are built without validation
+        id_prefix = f"{id}_"
         segments = [
-            TranscriptSegment(
-                id=f"{id}_{i}", start=seg["start"], end=seg["end"], text=seg["text"]
+            TranscriptSegment.model_construct(
+                id=id_prefix + str(i), start=seg["start"], end=seg["end"], text=seg["text"]
             )
             for i, seg in enumerate(result["segments"])
         ]
 
-        # Index text transcript
-        search_service.index_transcript(
-            Transcript(id=id, text=transcript_text, segments=segments)
+        # Index the transcript while frames are extracted and embedded
+        await asyncio.gather(
+            asyncio.to_thread(
+                search_service.index_transcript,
+                Transcript(id=id, text=transcript_text, segments=segments),
+            ),
+            index_video_frames(id, video_path, segments),
         )
 
-        # Process visual information
-        try:
-            logger.info(f"Starting visual processing for transcript {id}")
-
-            # Extract frames for each segment
-            frames_by_segment = await asyncio.get_event_loop().run_in_executor(
-                executor,
-                visual_processing_service.extract_frames_for_segments,
-                video_path,
-                segments,
-                0.5,  # Extract 1 frame every 2 seconds
-            )
-
-            # Generate embeddings for all frames
-            all_frame_paths = []
-            frame_segment_mapping = {}
-
-            for segment_id, frames in frames_by_segment.items():
-                for frame in frames:
-                    all_frame_paths.append(frame["path"])
-                    frame_segment_mapping[frame["path"]] = (
-                        segment_id,
-                        frame["timestamp"],
-                    )
-
-            if all_frame_paths:
-                embeddings = await asyncio.get_event_loop().run_in_executor(
-                    executor,
-                    visual_processing_service.generate_frame_embeddings,
-                    all_frame_paths,
-                )
-
-                # Prepare frame data with embeddings
-                frame_data_with_embeddings = {}
-                for i, frame_path in enumerate(all_frame_paths):
-                    segment_id, timestamp = frame_segment_mapping[frame_path]
-                    if segment_id not in frame_data_with_embeddings:
-                        frame_data_with_embeddings[segment_id] = []
-                    frame_data_with_embeddings[segment_id].append(
-                        {
-                            "timestamp": timestamp,
-                            "path": frame_path,
-                            "embedding": embeddings[i],
-                        }
-                    )
-
-                # Index visual embeddings
-                search_service.index_visual_embeddings(id, frame_data_with_embeddings)
-                logger.info(f"Visual processing completed for transcript {id}")
-
-        except Exception as e:
-            logger.error(f"Error during visual processing: {e}")
-            # Continue even if visual processing fails
-
         # Clean up the video file after visual processing
-        if os.path.exists(video_path):
-            os.remove(video_path)
+        if discard_file(video_path):
             logger.info(f"Deleted video file: {video_path}")
 
         # Add a background task to clean up the audio file after a delay
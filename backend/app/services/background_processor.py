@@ -2,46 +2,93 @@ import asyncio
 import logging
 import os
 from concurrent.futures import ThreadPoolExecutor
-from typing import Optional
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+import numpy as np
 
 from app.models.transcription import Transcript, TranscriptSegment
 from app.models.video import ProcessingStatus, VideoSource
 from app.services.search import search_service
 from app.services.transcription import (
+    TRANSCRIPTION_BATCH_SIZE,
     download_video,
-    extract_audio,
-    transcribe_audio,
+    extract_audio_array,
+    transcription_batcher,
 )
-from app.services.video_library import video_library_service
-from app.services.visual_processing import visual_processing_service
+from app.services.trash import discard_file
+from app.services.video_library import DATA_DIR, video_library_service, youtube_info_path
+from app.services.visual_indexing import index_video_frames
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, which runs a single worker
+    fcntl = None
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
-# Thread pool for CPU-bound operations
-executor = ThreadPoolExecutor(max_workers=2)
+# Stage-specific pools: downloads and ffmpeg are I/O bound; Whisper runs on the batcher's thread
+stage_executors = {
+    "net": ThreadPoolExecutor(max_workers=8, thread_name_prefix="processor-net"),
+}
+
+# Maximum number of queued videos; enqueue waits for a free slot beyond this
+PROCESSOR_QUEUE_MAX = int(os.getenv("PROCESSOR_QUEUE_MAX", "64"))
+# Seconds API requests wait for a free queue slot before giving up
+ENQUEUE_TIMEOUT = float(os.getenv("PROCESSOR_ENQUEUE_TIMEOUT", "5"))
+# Workers per pipeline stage
+DOWNLOAD_WORKERS = int(os.getenv("PROCESSOR_DOWNLOAD_WORKERS", "4"))
+# Enough in-flight transcriptions to fill one Whisper batch
+TRANSCRIBE_WORKERS = TRANSCRIPTION_BATCH_SIZE
+VISUAL_WORKERS = 1
+# Videos buffered between two stages before the earlier stage waits
+STAGE_QUEUE_MAX = 2
+# Held by the one uvicorn worker that resumes unfinished videos at startup
+RESUME_LOCK_PATH = DATA_DIR / "resume.lock"
+
+
+@dataclass
+class _PipelineJob:
+    """A video moving through the processing stages."""
+
+    video_id: str
+    title: str
+    video_path: str
+    whisper_model: str
+    audio: Optional[np.ndarray] = None  # 16kHz waveform, dropped once transcribed
+    transcript_text: str = ""
+    segments: list[TranscriptSegment] = field(default_factory=list)
 
 
 class BackgroundProcessor:
+    """
+    Processes library videos in three pipelined stages.
+
+    Download/audio extraction, transcription and visual indexing each read from
+    their own queue and hand the video to the next, so different videos occupy
+    different stages at the same time.
+    """
+
     _instance = None
     _queue: asyncio.Queue
+    _transcribe_queue: asyncio.Queue
+    _visual_queue: asyncio.Queue
     _processing: set[str]
     _running: bool
     _workers: list[asyncio.Task]
-    _max_concurrent: int
+    _resume_task: Optional[asyncio.Task]
+    _resume_lock = None
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance._queue = asyncio.Queue()
+            cls._instance._queue = asyncio.Queue(maxsize=PROCESSOR_QUEUE_MAX)
+            cls._instance._transcribe_queue = asyncio.Queue(maxsize=STAGE_QUEUE_MAX)
+            cls._instance._visual_queue = asyncio.Queue(maxsize=STAGE_QUEUE_MAX)
             cls._instance._processing = set()
             cls._instance._running = False
             cls._instance._workers = []
-            cls._instance._max_concurrent = 2
+            cls._instance._resume_task = None
         return cls._instance
 
     async def start(self):
@@ -51,35 +98,83 @@ class BackgroundProcessor:
             return
 
         self._running = True
+        stages = [
+            ("download", self._queue, self._stage_download, DOWNLOAD_WORKERS),
+            ("transcribe", self._transcribe_queue, self._stage_transcribe, TRANSCRIBE_WORKERS),
+            ("visual", self._visual_queue, self._stage_visual, VISUAL_WORKERS),
+        ]
         logger.info(
-            f"Starting background processor with {self._max_concurrent} workers"
+            "Starting background processor with "
+            + ", ".join(f"{count} {name}" for name, _, _, count in stages)
+            + " workers"
         )
 
         # Start worker tasks
-        for i in range(self._max_concurrent):
-            worker = asyncio.create_task(self._worker(i))
-            self._workers.append(worker)
+        for name, queue, handler, count in stages:
+            for i in range(count):
+                worker = asyncio.create_task(self._worker(f"{name}-{i}", queue, handler))
+                self._workers.append(worker)
 
     async def stop(self):
         """Stop background processing workers."""
         self._running = False
 
-        # Cancel all worker tasks
-        for worker in self._workers:
-            worker.cancel()
+        # Cancel all worker tasks and any pending resume
+        tasks = list(self._workers)
+        if self._resume_task:
+            tasks.append(self._resume_task)
+        for task in tasks:
+            task.cancel()
 
         # Wait for workers to finish
-        if self._workers:
-            await asyncio.gather(*self._workers, return_exceptions=True)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
 
         self._workers = []
+        self._resume_task = None
         logger.info("Background processor stopped")
 
-    async def enqueue(self, video_id: str):
-        """Add a video to the processing queue."""
-        await self._queue.put(video_id)
+    async def enqueue(self, video_id: str, timeout: Optional[float] = None):
+        """
+        Add a video to the processing queue.
+
+        Waits for a free slot while the queue is full. With a timeout,
+        asyncio.TimeoutError is raised if no slot frees up in time.
+        """
+        if timeout is None:
+            await self._queue.put(video_id)
+        else:
+            await asyncio.wait_for(self._queue.put(video_id), timeout=timeout)
         logger.info(f"Enqueued video {video_id} for processing")
 
+    def claim_resume(self) -> bool:
+        """
+        Whether this process should resume unfinished videos.
+
+        Every uvicorn worker runs its own processor for the videos it is
+        given, but the library is shared, so only the worker holding an
+        exclusive lock on RESUME_LOCK_PATH resumes it. The lock is held until
+        the process exits; a restarted worker can then take it over.
+        """
+        if fcntl is None or self._resume_lock is not None:
+            return True
+        lock_file = open(RESUME_LOCK_PATH, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._resume_lock = lock_file
+        return True
+
+    def resume(self, video_ids: list[str]):
+        """Enqueue videos from a background task so the caller is not blocked by a full queue."""
+        self._resume_task = asyncio.create_task(self._enqueue_all(video_ids))
+
+    async def _enqueue_all(self, video_ids: list[str]):
+        for video_id in video_ids:
+            await self.enqueue(video_id)
+
     def get_status(self) -> dict:
         """Get the current processing status."""
         return {
@@ -87,187 +182,166 @@ class BackgroundProcessor:
             "processing": list(self._processing),
         }
 
-    async def _worker(self, worker_id: int):
-        """Background worker that processes videos from the queue."""
-        logger.info(f"Worker {worker_id} started")
+    async def _worker(
+        self,
+        worker_name: str,
+        queue: asyncio.Queue,
+        handler: Callable[[Any], Awaitable[None]],
+    ):
+        """Background worker that runs one pipeline stage for items from its queue."""
+        logger.info(f"Worker {worker_name} started")
 
         while self._running:
             try:
                 # Wait for a video to process (with timeout to check running flag)
                 try:
-                    video_id = await asyncio.wait_for(self._queue.get(), timeout=1.0)
+                    item = await asyncio.wait_for(queue.get(), timeout=1.0)
                 except asyncio.TimeoutError:
                     continue
 
-                self._processing.add(video_id)
-                logger.info(f"Worker {worker_id} processing video {video_id}")
+                video_id = item if isinstance(item, str) else item.video_id
+                logger.info(f"Worker {worker_name} processing video {video_id}")
 
                 try:
-                    await self._process_video(video_id)
+                    await handler(item)
                 except Exception as e:
                     logger.error(f"Error processing video {video_id}: {e}")
                     video_library_service.update_video_status(
                         video_id, ProcessingStatus.FAILED, str(e)
                     )
-                finally:
                     self._processing.discard(video_id)
-                    self._queue.task_done()
+                finally:
+                    queue.task_done()
 
             except asyncio.CancelledError:
-                logger.info(f"Worker {worker_id} cancelled")
+                logger.info(f"Worker {worker_name} cancelled")
                 break
             except Exception as e:
-                logger.error(f"Worker {worker_id} error: {e}")
+                logger.error(f"Worker {worker_name} error: {e}")
 
-        logger.info(f"Worker {worker_id} stopped")
+        logger.info(f"Worker {worker_name} stopped")
 
-    async def _process_video(self, video_id: str):
-        """Process a single video through the full pipeline."""
+    async def _stage_download(self, video_id: str):
+        """Stage 1: fetch the video file, record its metadata and extract the audio."""
         video = video_library_service.get_video(video_id)
         if not video:
             logger.error(f"Video not found: {video_id}")
             return
 
         logger.info(f"Starting processing for video: {video.title} ({video_id})")
+        self._processing.add(video_id)
 
         # Update status to processing
         video_library_service.update_video_status(video_id, ProcessingStatus.PROCESSING)
 
-        try:
-            # Step 1: Get video file (download if YouTube)
-            video_path = video.file_path
-            if video.source == VideoSource.YOUTUBE and video.youtube_url:
-                logger.info(f"Downloading YouTube video: {video.youtube_url}")
-                await asyncio.get_event_loop().run_in_executor(
-                    executor, download_video, video.youtube_url, video_path
-                )
-
-            if not os.path.exists(video_path):
-                raise RuntimeError(f"Video file not found: {video_path}")
-
-            # Step 2: Get video duration and generate thumbnail
-            duration = video_library_service.get_video_duration(video_path)
-            thumbnail_path = video_library_service.generate_thumbnail(video_id)
-            video_library_service.update_video_metadata(
-                video_id, duration=duration, thumbnail_path=thumbnail_path
-            )
-
-            # Step 3: Extract audio
-            audio_path = video_path.rsplit(".", 1)[0] + ".mp3"
-            logger.info(f"Extracting audio to: {audio_path}")
-            await asyncio.get_event_loop().run_in_executor(
-                executor, extract_audio, video_path, audio_path
-            )
-
-            # Step 4: Transcribe
-            logger.info(f"Transcribing audio with model: {video.whisper_model}")
-            result = await asyncio.get_event_loop().run_in_executor(
-                executor,
-                transcribe_audio,
-                audio_path,
-                video.whisper_model,
-                None,  # Auto-detect language
-            )
-
-            # Step 5: Create transcript segments
-            transcript_text = result["text"]
-            segments = [
-                TranscriptSegment(
-                    id=f"{video_id}_{i}",
-                    start=seg["start"],
-                    end=seg["end"],
-                    text=seg["text"],
-                )
-                for i, seg in enumerate(result["segments"])
-            ]
-
-            # Step 6: Index transcript in ChromaDB
-            logger.info(f"Indexing transcript with {len(segments)} segments")
-            search_service.index_transcript(
-                Transcript(id=video_id, text=transcript_text, segments=segments)
+        loop = asyncio.get_running_loop()
+
+        # Get video file (download if YouTube)
+        video_path = video.file_path
+        if video.source == VideoSource.YOUTUBE and video.youtube_url:
+            logger.info(f"Downloading YouTube video: {video.youtube_url}")
+            info_path = youtube_info_path(video_id)
+            await loop.run_in_executor(
+                stage_executors["net"],
+                download_video,
+                video.youtube_url,
+                video_path,
+                str(info_path) if info_path.exists() else None,
             )
+            discard_file(str(info_path))
 
-            # Step 7: Extract frames and generate visual embeddings
-            await self._process_visual(video_id, video_path, segments)
+        if not os.path.exists(video_path):
+            raise RuntimeError(f"Video file not found: {video_path}")
 
-            # Step 8: Clean up audio file (keep video file for playback)
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-                logger.info(f"Cleaned up audio file: {audio_path}")
+        # Get video duration and generate thumbnail, probing the file only once
+        duration = await loop.run_in_executor(
+            stage_executors["net"], video_library_service.get_video_duration, video_path
+        )
+        thumbnail_path = await loop.run_in_executor(
+            stage_executors["net"],
+            video_library_service.generate_thumbnail,
+            video_id,
+            duration,
+        )
+        video_library_service.update_video_metadata(
+            video_id,
+            duration=duration,
+            thumbnail_path=thumbnail_path,
+            files_present=True,
+        )
 
-            # Step 9: Update status to completed
-            video_library_service.update_video_status(
-                video_id, ProcessingStatus.COMPLETED
-            )
-            logger.info(f"Video processing completed: {video.title} ({video_id})")
+        # Decode the audio in memory; no intermediate audio file is written
+        audio = await loop.run_in_executor(
+            stage_executors["net"], extract_audio_array, video_path
+        )
 
-        except Exception as e:
-            logger.error(f"Error processing video {video_id}: {e}")
-            video_library_service.update_video_status(
-                video_id, ProcessingStatus.FAILED, str(e)
+        await self._transcribe_queue.put(
+            _PipelineJob(
+                video_id=video_id,
+                title=video.title,
+                video_path=video_path,
+                whisper_model=video.whisper_model,
+                audio=audio,
             )
-            raise
+        )
 
-    async def _process_visual(
-        self, video_id: str, video_path: str, segments: list[TranscriptSegment]
-    ):
-        """Extract frames and generate visual embeddings."""
-        try:
-            logger.info(f"Starting visual processing for video {video_id}")
+    async def _stage_transcribe(self, job: _PipelineJob):
+        """Stage 2: transcribe the audio into segments."""
+        logger.info(f"Transcribing audio with model: {job.whisper_model}")
+        result = await transcription_batcher.submit(
+            job.audio,
+            job.whisper_model,
+            None,  # Auto-detect language
+        )
 
-            # Extract frames for each segment
-            frames_by_segment = await asyncio.get_event_loop().run_in_executor(
-                executor,
-                visual_processing_service.extract_frames_for_segments,
-                video_path,
-                segments,
-                0.5,  # Extract 1 frame every 2 seconds
+        # Create transcript segments; Whisper output is trusted, so skip validation
+        job.transcript_text = result["text"]
+        id_prefix = f"{job.video_id}_"
+        job.segments = [
+            TranscriptSegment.model_construct(
+                id=id_prefix + str(i),
+                start=seg["start"],
+                end=seg["end"],
+                text=seg["text"],
             )
-
-            # Generate embeddings for all frames
-            all_frame_paths = []
-            frame_segment_mapping = {}
-
-            for segment_id, frames in frames_by_segment.items():
-                for frame in frames:
-                    all_frame_paths.append(frame["path"])
-                    frame_segment_mapping[frame["path"]] = (
-                        segment_id,
-                        frame["timestamp"],
-                    )
-
-            if all_frame_paths:
-                logger.info(f"Generating embeddings for {len(all_frame_paths)} frames")
-                embeddings = await asyncio.get_event_loop().run_in_executor(
-                    executor,
-                    visual_processing_service.generate_frame_embeddings,
-                    all_frame_paths,
+            for i, seg in enumerate(result["segments"])
+        ]
+        job.audio = None
+
+        await self._visual_queue.put(job)
+
+    async def _stage_visual(self, job: _PipelineJob):
+        """Stage 3: index the transcript and visual embeddings, then mark the video done."""
+        # The transcript is written to ChromaDB while frames are decoded and embedded
+        logger.info(f"Indexing transcript with {len(job.segments)} segments")
+        tasks = [
+            asyncio.ensure_future(
+                asyncio.to_thread(
+                    search_service.index_transcript,
+                    Transcript(
+                        id=job.video_id, text=job.transcript_text, segments=job.segments
+                    ),
                 )
+            ),
+            asyncio.ensure_future(
+                index_video_frames(job.video_id, job.video_path, job.segments)
+            ),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # gather leaves the other task running when one fails; stop it and
+            # wait so no indexing continues after the job has failed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
 
-                # Prepare frame data with embeddings
-                frame_data_with_embeddings = {}
-                for i, frame_path in enumerate(all_frame_paths):
-                    segment_id, timestamp = frame_segment_mapping[frame_path]
-                    if segment_id not in frame_data_with_embeddings:
-                        frame_data_with_embeddings[segment_id] = []
-                    frame_data_with_embeddings[segment_id].append(
-                        {
-                            "timestamp": timestamp,
-                            "path": frame_path,
-                            "embedding": embeddings[i],
-                        }
-                    )
-
-                # Index visual embeddings
-                search_service.index_visual_embeddings(video_id, frame_data_with_embeddings)
-                logger.info(f"Visual processing completed for video {video_id}")
-            else:
-                logger.warning(f"No frames extracted for video {video_id}")
-
-        except Exception as e:
-            logger.error(f"Error during visual processing for {video_id}: {e}")
-            # Don't fail the whole processing if visual fails
-            # The transcript is still usable
+        video_library_service.update_video_status(
+            job.video_id, ProcessingStatus.COMPLETED
+        )
+        self._processing.discard(job.video_id)
+        logger.info(f"Video processing completed: {job.title} ({job.video_id})")
 
 
 # Singleton instance
@@ -0,0 +1,16 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads per uvicorn worker; total threads = THREAD_POOL_SIZE * WEB_CONCURRENCY
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", "32"))
+
+# Shared pool for blocking work in the routes. Installed as the event loop's
+# default executor in the app lifespan, so run_in_executor(None, ...) and
+# asyncio.to_thread both use it.
+default_executor = ThreadPoolExecutor(
+    max_workers=THREAD_POOL_SIZE, thread_name_prefix="app-io"
+)
+
+# Leaf lookups that a search overlaps with its own work. Searches may run on
+# default_executor, so waiting on this separate pool cannot exhaust that one.
+search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
@@ -0,0 +1,225 @@
+"""
+Frame extraction for transcript segments.
+
+This module deliberately imports neither torch nor the model services so that
+extract_frames can run in worker processes without loading SigLIP there.
+"""
+
+import cv2
+import logging
+import numpy as np
+import os
+from pathlib import Path
+from PIL import Image
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (segment_id, start, end)
+SegmentSpan = Tuple[str, float, float]
+
+# Frames whose dHash differs from the previous kept frame of the same segment
+# by fewer bits than this are skipped; 0 keeps every frame
+FRAME_DEDUPE_THRESHOLD = int(os.getenv("FRAME_DEDUPE_THRESHOLD", "5"))
+
+
+def extract_frames(
+    video_path: str,
+    segment_spans: List[SegmentSpan],
+    frames_per_second: float,
+    output_dir: str,
+    keep_images: bool = False,
+    image_size: Optional[Tuple[int, int]] = None,
+    resample: int = Image.BICUBIC,
+    dedupe_threshold: int = FRAME_DEDUPE_THRESHOLD,
+) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Extract frames for the given segments and return (segment_id, frames) pairs.
+
+    Picklable entry point for process pools; see iter_frames.
+    """
+    return list(
+        iter_frames(
+            video_path,
+            segment_spans,
+            frames_per_second,
+            output_dir,
+            keep_images,
+            image_size,
+            resample,
+            dedupe_threshold,
+        )
+    )
+
+
+def iter_frames(
+    video_path: str,
+    segment_spans: List[SegmentSpan],
+    frames_per_second: float,
+    output_dir: str,
+    keep_images: bool = False,
+    image_size: Optional[Tuple[int, int]] = None,
+    resample: int = Image.BICUBIC,
+    dedupe_threshold: int = FRAME_DEDUPE_THRESHOLD,
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Extract frames from video segment by segment, yielding (segment_id, frames).
+
+    Frames are written as JPEG to output_dir/{video_id}/. With keep_images,
+    each frame dict also carries the RGB image under "image", resized to
+    image_size (width, height) with the given PIL resample filter when set.
+
+    Near-duplicate frames (dHash within dedupe_threshold bits of the previous
+    kept frame in the segment) are neither written nor returned, which skips
+    the long runs of identical slides typical for lectures.
+    """
+
+    logger.info(f"Starting frame extraction from video: {video_path}")
+    logger.info(f"Number of segments to process: {len(segment_spans)}")
+
+    # Check if video file exists
+    if not os.path.exists(video_path):
+        logger.error(f"Video file not found: {video_path}")
+        return
+
+    cap = cv2.VideoCapture(video_path)
+
+    # Check if video opened successfully
+    if not cap.isOpened():
+        logger.error(f"Failed to open video: {video_path}")
+        return
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    logger.info(f"Video FPS: {fps}, Total frames: {total_frames}")
+
+    video_id = Path(video_path).stem
+    video_frame_dir = Path(output_dir) / video_id
+    video_frame_dir.mkdir(exist_ok=True, parents=True)
+    logger.info(f"Frame output directory: {video_frame_dir}")
+
+    def frame_info(segment_id: str, timestamp: float, frame_path: Path, frame) -> Dict[str, Any]:
+        info = {
+            "timestamp": timestamp,
+            "path": str(frame_path),
+            "segment_id": segment_id,
+        }
+        if keep_images:
+            info["image"] = _to_model_image(frame, image_size, resample)
+        return info
+
+    previous_hash = None
+
+    def is_duplicate(frame) -> bool:
+        nonlocal previous_hash
+        if dedupe_threshold <= 0:
+            return False
+        frame_hash = _dhash(frame)
+        if previous_hash is not None and _hamming(frame_hash, previous_hash) < dedupe_threshold:
+            return True
+        previous_hash = frame_hash
+        return False
+
+    segments_processed = 0
+    total_frames_extracted = 0
+    duplicates_skipped = 0
+    try:
+
+        for segment_id, start_time, end_time in segment_spans:
+            segment_frames = []
+            previous_hash = None
+
+            # Calculate frame extraction times within this segment
+            interval = 1.0 / frames_per_second
+
+            # Extract frames at regular intervals within the segment
+            current_time = start_time
+            while current_time <= end_time:
+                # Seek to the specific timestamp in the video
+                frame_number = int(current_time * fps)
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+
+                ret, frame = cap.read()
+                if ret and is_duplicate(frame):
+                    duplicates_skipped += 1
+                elif ret:
+                    # Save the frame to disk
+                    frame_filename = f"frame_{current_time:.2f}.jpg"
+                    frame_path = video_frame_dir / frame_filename
+                    success = cv2.imwrite(str(frame_path), frame)
+
+                    if success:
+                        segment_frames.append(
+                            frame_info(segment_id, current_time, frame_path, frame)
+                        )
+                        total_frames_extracted += 1
+                    else:
+                        logger.error(
+                            f"Failed to save frame at {current_time:.2f}s to {frame_path}"
+                        )
+                else:
+                    logger.warning(
+                        f"Failed to read frame at {current_time:.2f}s (frame {frame_number})"
+                    )
+
+                current_time += interval
+
+            # Also extract frame at segment end if not already included
+            if (
+                len(segment_frames) == 0
+                or segment_frames[-1]["timestamp"] < end_time
+            ):
+                frame_number = int(end_time * fps)
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+                ret, frame = cap.read()
+                if ret and is_duplicate(frame):
+                    duplicates_skipped += 1
+                elif ret:
+                    frame_filename = f"frame_{end_time:.2f}.jpg"
+                    frame_path = video_frame_dir / frame_filename
+                    cv2.imwrite(str(frame_path), frame)
+                    segment_frames.append(
+                        frame_info(segment_id, end_time, frame_path, frame)
+                    )
+
+            segments_processed += 1
+            logger.info(
+                f"Extracted {len(segment_frames)} frames for segment {segment_id} ({start_time:.2f}s to {end_time:.2f}s)"
+            )
+            yield segment_id, segment_frames
+
+    finally:
+        cap.release()
+        logger.info(
+            f"Frame extraction complete. Total frames extracted: {total_frames_extracted}"
+        )
+        logger.info(f"Segments with frames: {segments_processed}")
+        if duplicates_skipped:
+            logger.info(f"Near-duplicate frames skipped: {duplicates_skipped}")
+
+
+def _dhash(frame, hash_size: int = 8) -> np.ndarray:
+    """Difference hash of a BGR frame as packed bits (hash_size * hash_size bits)."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+
+def _hamming(a: np.ndarray, b: np.ndarray) -> int:
+    """Number of differing bits between two packed hashes."""
+    return int(np.unpackbits(a ^ b).sum())
+
+
+def _to_model_image(
+    frame, image_size: Optional[Tuple[int, int]], resample: int
+) -> Image.Image:
+    """
+    Convert an OpenCV BGR frame to an RGB image, at the model's input size if known.
+
+    Resizing here keeps the image small when it is sent back from a worker
+    process; the processor's own resize is then a no-op.
+    """
+    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    if image_size is None:
+        return image
+    return image.resize(image_size, resample)
@@ -1,23 +1,332 @@
+import asyncio
+import functools
+import hashlib
+import httpx
 import logging
+import numpy as np
+import orjson
 import os
+import platform
 import re
-import torch
-from typing import List, Optional
-from openai import OpenAI
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from openai import AsyncOpenAI, DefaultAioHttpClient, OpenAI
 from dotenv import load_dotenv
 
 from app.models.llms import LlmAnswer, LlmInfo
 from app.models.search import QueryResult
 
+try:
+    import tiktoken
+except ImportError:  # installed with openai-whisper; estimated from length otherwise
+    tiktoken = None
+
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
+# Concurrent connections the async client may open; batched answers should
+# reach the LLM server together rather than queue for a free connection
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "512"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "120"))
+# Send async requests over aiohttp instead of httpx (needs openai[aiohttp])
+LLM_USE_AIOHTTP = os.getenv("LLM_USE_AIOHTTP", "false").lower() == "true"
+# Accelerator of the LLM server: "cuda", "mps" or "cpu"; when unset, vLLM is
+# assumed to run on CUDA and Ollama is assumed to run on this host
+LLM_DEVICE = os.getenv("LLM_DEVICE", "").lower()
+# Context window of the served model; answer prompts are trimmed to fit it
+LLM_MAX_CONTEXT_TOKENS = int(os.getenv("LLM_MAX_CONTEXT_TOKENS", "32768"))
+# Headroom for chat template tokens and tokenizer mismatch, since counts use
+# cl100k_base rather than the served model's own tokenizer
+PROMPT_TOKEN_MARGIN = 256
+# Completion budget for an answer; SUMMARY and COMPLETENESS fit in ~120
+# tokens, and vLLM reserves KV cache for the whole budget. That leaves no room
+# for a think block, so thinking is switched off for answers by default.
+ANSWER_MAX_TOKENS = int(os.getenv("LLM_ANSWER_MAX_TOKENS", "160"))
+# Let reasoning models think before answering; when off, answer prompts for
+# Qwen3 models end in their /no_think switch. Raise LLM_ANSWER_MAX_TOKENS when turning this on.
+LLM_ANSWER_THINKING = os.getenv("LLM_ANSWER_THINKING", "false").lower() == "true"
+# Hugging Face tokenizer whose chat template renders batched vLLM prompts;
+# defaults to LLM_MODEL, which vLLM serves under its Hugging Face id
+LLM_TOKENIZER = os.getenv("LLM_TOKENIZER", "")
+# Answers are extractive and structured, so sample close to greedy
+ANSWER_TEMPERATURE = 0.2
+# Stop if the model starts echoing the prompt layout after its answer. A bare
+# blank line can't be used since the format separates the two sections by one.
+ANSWER_STOP_SEQUENCES = ["\n\nQuestion:", "\n\nTranscript:"]
+# Milliseconds agenerate_answer waits to coalesce concurrent questions into one
+# vLLM completions request (0 disables), and the most questions per request
+LLM_MICROBATCH_MS = float(os.getenv("LLM_MICROBATCH_MS", "15"))
+LLM_MICROBATCH_MAX = int(os.getenv("LLM_MICROBATCH_MAX", "32"))
+# Answers kept for repeated questions about the same transcript (0 disables)
+LLM_ANSWER_CACHE_SIZE = int(os.getenv("LLM_ANSWER_CACHE_SIZE", "1024"))
+# Cosine similarity above which a differently worded question about the same
+# transcript reuses a cached answer (1 or more disables the semantic tier)
+LLM_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.97"))
+
+# Sections of an LLM answer, compiled once for _parse_response
+_THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
+_ANSWER_RE = re.compile(
+    r"SUMMARY:\s*\n?(?P<summary>.*?)(?=COMPLETENESS:|\Z)"
+    r"(?:COMPLETENESS:\s*\n?(?P<completeness>[^\n]*))?",
+    re.DOTALL | re.IGNORECASE,
+)
+_COMPLETENESS_RE = re.compile(
+    r"COMPLETENESS:\s*\n?(.*?)(?:\n|$)", re.DOTALL | re.IGNORECASE
+)
+# A COMPLETENESS line followed by a newline: the rest of a response is unused
+_COMPLETENESS_DONE_RE = re.compile(r"COMPLETENESS:\s*[^\n]*\S[^\n]*\n", re.IGNORECASE)
+
+# Everything in the answer prompt that does not depend on the question or the
+# transcript. It leads every request so the server's prefix cache can reuse
+# its KV entries; the transcript follows, then the question, so questions about
+# the same videos share the longest possible prefix.
+_STATIC_PREFIX = """You are a helpful assistant analyzing video transcripts. You always respond in the same language as the transcript you are analyzing, regardless of the language of the question.
+
+You are analyzing a video transcript to answer a question.
+Based on the transcript, provide a comprehensive answer.
+
+CRITICAL LANGUAGE REQUIREMENT:
+- You MUST write your answer in the SAME LANGUAGE as the transcript
+- If the transcript is in German, write your answer in German
+- If the transcript is in English, write your answer in English
+- If the transcript is in any other language, write your answer in that language
+- Do NOT translate to a different language
+- The user's question might be in a different language, but ALWAYS answer in the transcript's language
+
+You MUST format your response EXACTLY as follows:
+
+SUMMARY:
+[Write 2-3 sentences summarizing the answer IN THE SAME LANGUAGE AS THE TRANSCRIPT]
+
+COMPLETENESS:
+[State one of: "COMPLETE" if the transcript fully answers the question, "PARTIAL" if only some aspects are covered, or "NOT FOUND" if the transcript doesn't contain relevant information]
+
+Remember:
+- Start your response directly with "SUMMARY:" without any preamble
+- Write your answer in the SAME LANGUAGE as the transcript"""
+
+
+class _AnswerCache:
+    """
+    LRU cache of answers with an exact tier and a semantic tier.
+
+    Exact hits match on question and context. Semantic hits need the same
+    context and a question embedding close enough to a cached one.
+    """
+
+    def __init__(self, max_size: int, similarity_threshold: float):
+        self._max_size = max_size
+        self._similarity_threshold = similarity_threshold
+        # key -> (context_key, normalized question embedding or None, answer)
+        self._entries: "OrderedDict[int, Tuple[int, Optional[np.ndarray], LlmAnswer]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(
+        self, key: int, context_key: int, query_embedding: Optional[np.ndarray]
+    ) -> Optional[LlmAnswer]:
+        with self._lock:
+            if key not in self._entries and query_embedding is not None:
+                key = self._nearest_key(context_key, _normalize(query_embedding))
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(
+        self,
+        key: int,
+        context_key: int,
+        query_embedding: Optional[np.ndarray],
+        answer: LlmAnswer,
+    ) -> None:
+        if self._max_size <= 0:
+            return
+        embedding = None if query_embedding is None else _normalize(query_embedding)
+        with self._lock:
+            self._entries[key] = (context_key, embedding, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def _nearest_key(self, context_key: int, embedding: np.ndarray) -> Optional[int]:
+        if self._similarity_threshold >= 1:
+            return None
+        candidates = [
+            (key, cached_embedding)
+            for key, (cached_context, cached_embedding, _) in self._entries.items()
+            if cached_context == context_key and cached_embedding is not None
+        ]
+        if not candidates:
+            return None
+        similarities = np.stack([e for _, e in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self._similarity_threshold:
+            return None
+        return candidates[best][0]
+
+
+class AnswerBatcher:
+    """
+    Collects questions from concurrent callers and answers them in vLLM batches.
+
+    Questions arriving within LLM_MICROBATCH_MS of each other (up to
+    LLM_MICROBATCH_MAX) are sent as one /v1/completions request, so vLLM can
+    schedule them together instead of one HTTP request each.
+    """
+
+    def __init__(
+        self,
+        service: "LLMService",
+        max_batch_size: int = LLM_MICROBATCH_MAX,
+        window: float = LLM_MICROBATCH_MS / 1000,
+    ):
+        self._service = service
+        self._max_batch_size = max_batch_size
+        self._window = window
+        self._pending: List[
+            Tuple[str, List[QueryResult], int, Optional[np.ndarray], asyncio.Future]
+        ] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(
+        self,
+        question: str,
+        segments: List[QueryResult],
+        max_new_tokens: int,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> LlmAnswer:
+        """Queue a question for the next batch and wait for its answer."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((question, segments, max_new_tokens, query_embedding, future))
+
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            # Keep a reference so the task is not garbage collected mid-flight
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        logger.info(f"Answering batch of {len(batch)} question(s)")
+
+        # One request takes a single max_tokens, so split by completion budget
+        groups = {}
+        for job in batch:
+            groups.setdefault(job[2], []).append(job)
+
+        async def answer_group(max_new_tokens, jobs):
+            try:
+                answers = await asyncio.to_thread(
+                    self._service.generate_answers_vllm_batch,
+                    [(question, segments) for question, segments, _, _, _ in jobs],
+                    max_new_tokens,
+                    [embedding for _, _, _, embedding, _ in jobs],
+                )
+            except Exception as e:
+                answers = [e] * len(jobs)
+            for job, answer in zip(jobs, answers):
+                _resolve_future(job[4], answer)
+
+        await asyncio.gather(
+            *(answer_group(max_new_tokens, jobs) for max_new_tokens, jobs in groups.items())
+        )
+
+
+def _resolve_future(future: asyncio.Future, result) -> None:
+    if future.done():
+        return
+    if isinstance(result, BaseException):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+
+def _normalize(embedding: np.ndarray) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32)
+    return embedding / (np.linalg.norm(embedding) or 1.0)
+
+
+def _hash_key(*parts: str) -> int:
+    digest = hashlib.blake2b("\x1f".join(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _append_chunk(buffer: str, chunk) -> Tuple[str, bool]:
+    """
+    Add a streamed chat chunk to the buffer and report whether the answer is done.
+
+    Closing the stream early lets the server free the generation slot instead
+    of producing tokens _parse_response would ignore.
+    """
+    text = chunk.choices[0].delta.content if chunk.choices else None
+    if not text:
+        return buffer, False
+    buffer += text
+    # Only a newline can complete the COMPLETENESS line
+    if "\n" not in text:
+        return buffer, False
+    # Ignore sections a reasoning model writes inside its think block
+    if "<think>" in buffer:
+        think_end = buffer.rfind("</think>")
+        if think_end == -1:
+            return buffer, False
+        return buffer, bool(_COMPLETENESS_DONE_RE.search(buffer, think_end))
+    return buffer, bool(_COMPLETENESS_DONE_RE.search(buffer))
+
+
+def _is_truncated(chunk) -> bool:
+    """Whether a streamed chat chunk reports that generation hit max_tokens."""
+    return bool(chunk.choices) and chunk.choices[0].finish_reason == "length"
+
+
+def _detect_device() -> str:
+    if shutil.which("nvidia-smi"):
+        return "cuda"
+    if sys.platform == "darwin" and platform.machine() == "arm64":
+        return "mps"
+    return "cpu"
+
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable, estimating token counts: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=16384)
+def _count_tokens(text: str) -> int:
+    """Approximate token count; cached since the same segments recur across questions."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
 
 class LLMService:
     """
@@ -25,37 +334,36 @@ class LLMService:
     """
 
     _instance = None
+    _instance_lock = threading.Lock()
     _client = None
+    _aclient = None
     _backend = None
     _base_url = None
     _api_key = None
     _model_id = None
     _device = None
     _has_gpu = False
+    _use_aiohttp = LLM_USE_AIOHTTP
+    # Shared by every answer request; the OpenAI SDK does not mutate messages
+    _system_message = None
+    # Loaded at warm-up for vLLM batching; None renders plain prompts
+    _chat_tokenizer = None
+    _batcher = None
+    _answer_cache = _AnswerCache(LLM_ANSWER_CACHE_SIZE, LLM_SEMANTIC_CACHE_THRESHOLD)
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._initialize()
+            # The service is created lazily, possibly from several request threads
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance._initialize()
+                    cls._instance = instance
         return cls._instance
 
     def _initialize(self):
         """Initialize the LLM service based on environment configuration."""
 
-        # Check for CUDA (NVIDIA) or MPS (Apple Silicon)
-        if torch.cuda.is_available():
-            self._device = "cuda"
-            self._has_gpu = True
-            logger.info("Using CUDA GPU for inference")
-        elif torch.backends.mps.is_available() and torch.backends.mps.is_built():
-            self._device = "mps"
-            self._has_gpu = True
-            logger.info("Using Apple Silicon GPU (MPS) for inference")
-        else:
-            self._device = "cpu"
-            self._has_gpu = False
-            logger.info("Using CPU for inference")
-
         # Select backend (Ollama/vLLM)
         self._backend = os.getenv("LLM_BACKEND", "ollama").lower()
 
@@ -76,88 +384,360 @@ class LLMService:
         else:
             raise ValueError(f"Unsupported LLM backend: {self._backend}")
 
-        # Initialize OpenAI client
+        # Only Qwen3 models know the /no_think switch; others would read it as text
+        no_think = not LLM_ANSWER_THINKING and "qwen3" in self._model_id.lower()
+        self._system_message = {
+            "role": "system",
+            "content": f"{_STATIC_PREFIX}\n/no_think" if no_think else _STATIC_PREFIX,
+        }
+
+        # Inference runs on the LLM server, not here. vLLM serves from GPUs;
+        # Ollama usually runs on this host, so its accelerator is detected
+        # without initializing torch.
+        self._device = LLM_DEVICE or (
+            "cuda" if self._backend == "vllm" else _detect_device()
+        )
+        self._has_gpu = self._device != "cpu"
+        if self._device == "cuda":
+            logger.info("Using CUDA GPU for inference")
+        elif self._device == "mps":
+            logger.info("Using Apple Silicon GPU (MPS) for inference")
+        else:
+            logger.info("Using CPU for inference")
+
+        # Initialize OpenAI clients
         self._client = OpenAI(
             base_url=self._base_url,
             api_key=self._api_key,
         )
+        self._aclient = self._create_async_client()
+        # Only vLLM can take many prompts in one request
+        if self._backend == "vllm" and LLM_MICROBATCH_MS > 0:
+            self._batcher = AnswerBatcher(self)
 
         logger.info(
             f"Initialized {self._backend} LLM service with model: {self._model_id}"
         )
 
+    async def warm_up(self) -> None:
+        """Load the chat tokenizer for batched vLLM prompts before the first request."""
+        if self._batcher is None:
+            return
+        self._chat_tokenizer = await asyncio.to_thread(self._load_chat_tokenizer)
+        if self._chat_tokenizer is not None:
+            logger.info("Loaded chat tokenizer for batched answers.")
+
+    def _create_async_client(self) -> AsyncOpenAI:
+        """Create an AsyncOpenAI client sized for many concurrent requests."""
+        limits = httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS // 2,
+        )
+        timeout = httpx.Timeout(LLM_REQUEST_TIMEOUT, connect=5.0)
+
+        http_client = None
+        if self._use_aiohttp:
+            try:
+                http_client = DefaultAioHttpClient(limits=limits, timeout=timeout)
+            except RuntimeError as e:
+                logger.warning(f"aiohttp transport unavailable, using httpx: {e}")
+                self._use_aiohttp = False
+        if http_client is None:
+            http_client = httpx.AsyncClient(
+                # Limits belong to the transport once one is passed explicitly
+                transport=httpx.AsyncHTTPTransport(limits=limits, retries=0),
+                timeout=timeout,
+                follow_redirects=True,
+            )
+
+        return AsyncOpenAI(
+            base_url=self._base_url,
+            api_key=self._api_key,
+            http_client=http_client,
+        )
+
     def generate_answer(
-        self, question: str, segments: List[QueryResult], max_new_tokens: int = 512
+        self,
+        question: str,
+        segments: List[QueryResult],
+        max_new_tokens: int = ANSWER_MAX_TOKENS,
+        query_embedding: Optional[np.ndarray] = None,
     ) -> LlmAnswer:
-        """Generate a structured answer using the LLM."""
+        """
+        Generate a structured answer using the LLM.
+
+        Answers are cached per question and context; passing the question's
+        retrieval embedding also lets near-identical rephrasings hit the cache.
+        """
+        cache_keys = self._answer_cache_keys(question, segments, max_new_tokens)
+        cached = self._answer_cache.get(*cache_keys, query_embedding)
+        if cached is not None:
+            logger.info(f"Answer cache hit for question: {question}")
+            return cached
+
         try:
-            prompt = self._create_prompt(question, segments)
+            # Stream the chat completion and stop once the answer is complete
+            buffer = ""
+            truncated = False
+            with self._client.chat.completions.create(
+                **self._completion_kwargs(question, segments, max_new_tokens), stream=True
+            ) as stream:
+                for chunk in stream:
+                    buffer, done = _append_chunk(buffer, chunk)
+                    if done:
+                        break
+                    truncated = truncated or _is_truncated(chunk)
+            answer, has_summary = self._parse_response(buffer, question)
+            # An answer cut off by the token budget may lack its last sentences
+            if has_summary and not truncated:
+                self._answer_cache.put(*cache_keys, query_embedding, answer)
+            return answer
 
-            # Use chat completions API
-            response = self._client.chat.completions.create(
+        except Exception as e:
+            logger.error(f"Error generating answer: {e}")
+            return self._error_answer(e)
+
+    async def agenerate_answer(
+        self,
+        question: str,
+        segments: List[QueryResult],
+        max_new_tokens: int = ANSWER_MAX_TOKENS,
+        query_embedding: Optional[np.ndarray] = None,
+    ) -> LlmAnswer:
+        """Async variant of generate_answer, so many questions can be in flight at once."""
+        cache_keys = self._answer_cache_keys(question, segments, max_new_tokens)
+        cached = self._answer_cache.get(*cache_keys, query_embedding)
+        if cached is not None:
+            logger.info(f"Answer cache hit for question: {question}")
+            return cached
+
+        # Coalesce with other callers on this loop into one vLLM completions call
+        if self._batcher is not None:
+            return await self._batcher.submit(
+                question, segments, max_new_tokens, query_embedding
+            )
+
+        try:
+            buffer = ""
+            truncated = False
+            async with await self._aclient.chat.completions.create(
+                **self._completion_kwargs(question, segments, max_new_tokens), stream=True
+            ) as stream:
+                async for chunk in stream:
+                    buffer, done = _append_chunk(buffer, chunk)
+                    if done:
+                        break
+                    truncated = truncated or _is_truncated(chunk)
+            answer, has_summary = self._parse_response(buffer, question)
+            if has_summary and not truncated:
+                self._answer_cache.put(*cache_keys, query_embedding, answer)
+            return answer
+
+        except Exception as e:
+            logger.error(f"Error generating answer: {e}")
+            return self._error_answer(e)
+
+    def generate_answers_vllm_batch(
+        self,
+        items: List[Tuple[str, List[QueryResult]]],
+        max_new_tokens: int = ANSWER_MAX_TOKENS,
+        query_embeddings: Optional[List[Optional[np.ndarray]]] = None,
+    ) -> List[LlmAnswer]:
+        """
+        Answer several (question, segments) pairs with a single completions call.
+
+        vLLM accepts a list of prompts on /v1/completions and schedules them in
+        the same continuous-batching window; AnswerBatcher sends its batches
+        here. query_embeddings, aligned with items, enable semantic cache hits.
+        """
+        if query_embeddings is None:
+            query_embeddings = [None] * len(items)
+        cache_keys = [
+            self._answer_cache_keys(question, segments, max_new_tokens)
+            for question, segments in items
+        ]
+        answers: List[Optional[LlmAnswer]] = [
+            self._answer_cache.get(*keys, embedding)
+            for keys, embedding in zip(cache_keys, query_embeddings)
+        ]
+        # Only questions without a cached answer go to the server
+        pending = [i for i, answer in enumerate(answers) if answer is None]
+        if not pending:
+            return answers
+
+        try:
+            # Raw response: orjson decodes the body instead of the SDK building
+            # pydantic models for every choice in a large batch
+            response = self._client.completions.with_raw_response.create(
                 model=self._model_id,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant analyzing video transcripts. You always respond in the same language as the transcript you are analyzing, regardless of the language of the question.",
-                    },
-                    {"role": "user", "content": prompt},
+                prompt=[
+                    self._render_chat_prompt(
+                        self._build_messages(*items[i], max_new_tokens)
+                    )
+                    for i in pending
                 ],
                 max_tokens=max_new_tokens,
-                temperature=0.7,
+                temperature=ANSWER_TEMPERATURE,
+                stop=ANSWER_STOP_SEQUENCES,
             )
+            # One choice per prompt; index ties it back to its question
+            choices = orjson.loads(response.http_response.content)["choices"]
+            texts = {choice["index"]: choice["text"] for choice in choices}
+            truncated = {
+                choice["index"]
+                for choice in choices
+                if choice.get("finish_reason") == "length"
+            }
+        except Exception as e:
+            logger.error(f"Error generating batched answers: {e}")
+            return [answer or self._error_answer(e) for answer in answers]
+
+        for position, i in enumerate(pending):
+            text = texts.get(position)
+            if text is None:
+                logger.error(f"No completion returned for batched prompt {position}")
+                answers[i] = self._error_answer(
+                    ValueError("no completion returned for this question")
+                )
+                continue
+            answers[i], has_summary = self._parse_response(text, items[i][0])
+            if has_summary and position not in truncated:
+                self._answer_cache.put(*cache_keys[i], query_embeddings[i], answers[i])
+        return answers
+
+    def _render_chat_prompt(self, messages: List[dict]) -> str:
+        """
+        Render chat messages as a single completion prompt.
+
+        Uses the model's own chat template when its tokenizer was loaded at
+        warm-up, else a plain role-prefixed layout.
+        """
+        if self._chat_tokenizer is not None:
+            return self._chat_tokenizer.apply_chat_template(
+                messages, tokenize=False, add_generation_prompt=True
+            )
+        rendered = "\n\n".join(
+            f"{message['role'].capitalize()}: {message['content']}" for message in messages
+        )
+        return f"{rendered}\n\nAssistant:"
 
-            response_text = response.choices[0].message.content
-
-            answer = self._parse_response(response_text, question)
-
-            return answer
+    def _load_chat_tokenizer(self):
+        """The served model's tokenizer if it has a chat template, else None."""
+        tokenizer_id = LLM_TOKENIZER or self._model_id
+        try:
+            # Imported lazily; only vLLM batching needs a local tokenizer
+            from transformers import AutoTokenizer
 
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_id)
+            if not tokenizer.chat_template:
+                raise ValueError("tokenizer has no chat template")
+            return tokenizer
         except Exception as e:
-            logger.error(f"Error generating answer: {e}")
-            return LlmAnswer(
-                summary=f"Error generating answer: {str(e)}",
-                not_addressed=True,
-                model_id=self._model_id,
+            logger.warning(
+                f"No chat template for {tokenizer_id}, using plain prompts "
+                f"(set LLM_TOKENIZER to the served model's Hugging Face id): {e}"
             )
+            return None
+
+    def _answer_cache_keys(
+        self, question: str, segments: List[QueryResult], max_new_tokens: int
+    ) -> Tuple[int, int]:
+        """(answer key, context key) identifying a question against its transcript."""
+        context_key = _hash_key(
+            self._model_id, str(max_new_tokens), *(segment.text for segment in segments)
+        )
+        return _hash_key(str(context_key), question), context_key
+
+    def _completion_kwargs(
+        self, question: str, segments: List[QueryResult], max_new_tokens: int
+    ) -> dict:
+        """Arguments for a chat completion answering the question."""
+        return {
+            "model": self._model_id,
+            "messages": self._build_messages(question, segments, max_new_tokens),
+            "max_tokens": max_new_tokens,
+            "temperature": ANSWER_TEMPERATURE,
+            "stop": ANSWER_STOP_SEQUENCES,
+        }
+
+    def _build_messages(
+        self,
+        question: str,
+        segments: List[QueryResult],
+        max_new_tokens: int = ANSWER_MAX_TOKENS,
+    ) -> List[dict]:
+        """Chat messages for answering a question from transcript segments."""
+        segments = self._fit_segments(question, segments, max_new_tokens)
+        return [
+            self._system_message,
+            {"role": "user", "content": self._create_prompt(question, segments)},
+        ]
+
+    def _error_answer(self, error: Exception) -> LlmAnswer:
+        return LlmAnswer(
+            summary=f"Error generating answer: {str(error)}",
+            not_addressed=True,
+            model_id=self._model_id,
+        )
+
+    def _fit_segments(
+        self, question: str, segments: List[QueryResult], max_new_tokens: int
+    ) -> List[QueryResult]:
+        """
+        Drop segments until the prompt fits LLM_MAX_CONTEXT_TOKENS.
+
+        The most relevant segments are kept (those without a score last, earlier
+        ones first among equals) and returned in their original order.
+        """
+        budget = (
+            LLM_MAX_CONTEXT_TOKENS
+            - _count_tokens(_STATIC_PREFIX)
+            - _count_tokens(question)
+            - max_new_tokens
+            - PROMPT_TOKEN_MARGIN
+        )
+        counts = [_count_tokens(segment.text) for segment in segments]
+        if sum(counts) <= budget:
+            return segments
+
+        ranked = sorted(
+            range(len(segments)),
+            key=lambda i: segments[i].relevance_score or 0.0,
+            reverse=True,
+        )
+        kept = []
+        used = 0
+        for i in ranked:
+            if used + counts[i] <= budget:
+                kept.append(i)
+                used += counts[i]
+
+        logger.info(
+            f"Trimmed LLM context from {len(segments)} to {len(kept)} segments "
+            f"({used} of {budget} tokens)"
+        )
+        return [segments[i] for i in sorted(kept)]
 
     def _create_prompt(self, question: str, segments: List[QueryResult]) -> str:
-        """Create a structured prompt for the LLM."""
+        """Create the per-request part of the prompt; instructions live in _STATIC_PREFIX."""
         # Join all segment texts without timestamps for cleaner context
         context = " ".join([segment.text for segment in segments])
 
-        prompt = f"""You are analyzing a video transcript to answer a question.
-Based on the transcript below, provide a comprehensive answer.
-
-CRITICAL LANGUAGE REQUIREMENT:
-- You MUST write your answer in the SAME LANGUAGE as the transcript
-- If the transcript is in German, write your answer in German
-- If the transcript is in English, write your answer in English
-- If the transcript is in any other language, write your answer in that language
-- Do NOT translate to a different language
-- The user's question might be in a different language, but ALWAYS answer in the transcript's language
-
-Transcript:
+        return f"""Transcript:
 {context}
 
 Question: {question}
 
-You MUST format your response EXACTLY as follows:
-
-SUMMARY:
-[Write 2-3 sentences summarizing the answer IN THE SAME LANGUAGE AS THE TRANSCRIPT]
-
-COMPLETENESS:
-[State one of: "COMPLETE" if the transcript fully answers the question, "PARTIAL" if only some aspects are covered, or "NOT FOUND" if the transcript doesn't contain relevant information]
+Respond with SUMMARY: and COMPLETENESS: as instructed, in the transcript's language."""
 
-Remember: 
-- Start your response directly with "SUMMARY:" without any preamble
-- Write your answer in the SAME LANGUAGE as the transcript above"""
+    def _parse_response(self, response: str, question: str) -> Tuple[LlmAnswer, bool]:
+        """
+        Parse the LLM response into structured format.
 
-        return prompt
-
-    def _parse_response(self, response: str, question: str) -> LlmAnswer:
-        """Parse the LLM response into structured format."""
+        Also returns whether the response had a SUMMARY section; answers built
+        from fallbacks, like those cut off by the token budget, are not worth
+        caching.
+        """
         summary = ""
         not_addressed = False
 
@@ -166,82 +746,61 @@ Remember:
         # Clean up any thinking tags or meta-commentary
         if "<think>" in response:
             # Remove everything between <think> and </think>
-            response = re.sub(
-                r"<think>.*?</think>", "", response, flags=re.DOTALL
-            ).strip()
+            response = _THINK_RE.sub("", response)
+            # A completion cut off while thinking leaves an unclosed block
+            response = response.partition("<think>")[0].strip()
 
         # Remove any leading/trailing whitespace or empty lines
         response = response.strip()
 
-        # If response contains SUMMARY:, extract from there onwards (ignoring any preceding text)
-        summary_start = response.find("SUMMARY:")
-        if summary_start != -1:
-            response = response[summary_start:]
-
-        logger.info(f"Parsing response: {response[:200]}...")  # Log first 200 chars
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Parsing response: {response[:200]}...")  # Log first 200 chars
 
-        # Extract SUMMARY section
-        summary_match = re.search(
-            r"SUMMARY:\s*\n?(.*?)(?=COMPLETENESS:|$)",
-            response,
-            re.DOTALL | re.IGNORECASE,
-        )
-        if summary_match:
-            summary = summary_match.group(1).strip()
+        # Extract SUMMARY and the COMPLETENESS after it in one pass
+        completeness_str = None
+        answer_match = _ANSWER_RE.search(response)
+        if answer_match:
             # Remove any bullet points or extra formatting
-            summary = " ".join(summary.split())  # Normalize whitespace
+            summary = " ".join(answer_match.group("summary").split())  # Normalize whitespace
+            completeness_str = answer_match.group("completeness")
+        else:
+            completeness_match = _COMPLETENESS_RE.search(response)
+            if completeness_match:
+                completeness_str = completeness_match.group(1)
 
-        # Extract COMPLETENESS section
-        completeness_match = re.search(
-            r"COMPLETENESS:\s*\n?(.*?)(?:\n|$)", response, re.DOTALL | re.IGNORECASE
-        )
-        if completeness_match:
-            completeness_str = completeness_match.group(1).strip().upper()
-            if "NOT FOUND" in completeness_str or "NOT_FOUND" in completeness_str:
-                not_addressed = True
-            else:
-                not_addressed = False
+        if completeness_str is not None:
+            completeness_str = completeness_str.strip().upper()
+            not_addressed = "NOT FOUND" in completeness_str or "NOT_FOUND" in completeness_str
 
         # Fallbacks if parsing fails
         if not summary:
-            # Try to extract first paragraph as summary
-            first_para = response.split("\n\n")[0].strip()
-            if first_para and not first_para.startswith(("SUMMARY:", "COMPLETENESS:")):
+            # Without a SUMMARY section, the first paragraph is likely the answer
+            first_para = "" if answer_match else response.partition("\n\n")[0].strip()
+            if first_para and not first_para.startswith("COMPLETENESS:"):
                 summary = first_para
             else:
                 summary = f"Analysis of the video transcript regarding: {question}"
 
-        return LlmAnswer(
+        answer = LlmAnswer(
             summary=summary,
             not_addressed=not_addressed,
             model_id=self._model_id,
         )
+        return answer, answer_match is not None
 
     def generate_summary(self, transcript: str, max_new_tokens: int = 512) -> str:
         prompt = f"""You are an AI assistant tasked with summarizing a video transcript.
 Here is the transcript:
 {transcript}
 Please provide a concise summary of the main points in 2-3 sentences."""
-        inputs = self._active_tokenizer(
-            prompt, return_tensors="pt", truncation=True, max_length=2048
-        )
-        if (
-            self._device == "cuda"
-            and "device_map" not in self._models[self._active_model_id]
-        ):
-            inputs = inputs.to(self._device)
-        with torch.no_grad():
-            outputs = self._active_model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                temperature=0.7,
-                do_sample=True,
-                top_p=0.9,
-            )
-        response = self._active_tokenizer.decode(
-            outputs[0][inputs["input_ids"].shape[1] :], skip_special_tokens=True
+        response = self._client.chat.completions.create(
+            model=self._model_id,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_new_tokens,
+            temperature=0.7,
+            top_p=0.9,
         )
-        return response.strip()
+        return _THINK_RE.sub("", response.choices[0].message.content).strip()
 
     def get_available_models(self) -> List[LlmInfo]:
         """Get list of available models (just the configured one)."""
@@ -270,4 +829,11 @@ Please provide a concise summary of the main points in 2-3 sentences."""
         return self._has_gpu
 
 
-llm_service = LLMService()
+class _LazyLLMService:
+    """Stand-in for the LLMService singleton that creates it on first use."""
+
+    def __getattr__(self, name):
+        return getattr(LLMService(), name)
+
+
+llm_service = _LazyLLMService()
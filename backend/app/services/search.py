@@ -1,7 +1,19 @@
+import asyncio
 import chromadb
+import functools
+import heapq
 import logging
+import numpy as np
 import os
-from typing import Optional
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from itertools import islice
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional
+from uuid import UUID
+from chromadb.errors import NotFoundError
 from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
 
 from app.models.transcription import Transcript
@@ -15,63 +27,118 @@ from app.models.search import (
     VisualSearchResponse,
 )
 from app.models.llms import LlmAnswer
+from app.models.video import TranscriptSegmentResponse
+from app.services.executors import search_executor
 from app.services.llms import llm_service
 from app.services.visual_processing import visual_processing_service
 from app.services.video_library import video_library_service
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 EMBEDDING_MODEL_NAME = os.getenv(
     "EMBEDDING_MODEL_NAME",
     "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
 )
+# SentenceTransformer backend on CPU hosts: "torch", or "onnx"/"openvino" for
+# fused inference kernels (require sentence-transformers[onnx] / [openvino])
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
 CHROMA_DB_DIR = os.getenv("CHROMA_DB_DIR", "chroma_db")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "transcript_embeddings")
 VISUAL_COLLECTION_NAME = os.getenv("VISUAL_COLLECTION_NAME", "visual_embeddings")
+# HNSW graph parameters. M and construction ef only apply to newly created
+# collections; search ef is also applied to existing ones on startup.
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "200"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "64"))
+HNSW_METADATA = {
+    "hnsw:space": "cosine",  # Use cosine similarity
+    "hnsw:M": HNSW_M,
+    "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+    "hnsw:search_ef": HNSW_SEARCH_EF,
+}
+SEGMENT_DB_PATH = os.path.join(CHROMA_DB_DIR, "segments.sqlite3")
+# Rows fetched per query when streaming a transcript
+SEGMENT_PAGE_SIZE = 500
+# The trigram full-text index can only match queries of at least three characters
+TRIGRAM_MIN_LENGTH = 3
+# Extracted frames are stored under this path and served from /media/frames
+FRAME_PATH_PREFIX = "data/frames/"
+# Videos whose ordered segments are kept in memory for repeated LLM searches
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "64"))
+# Question embeddings kept for repeated semantic and LLM searches
+QUESTION_EMBEDDING_CACHE_SIZE = 1024
+
+
+def _frame_url(frame_path: Optional[str]) -> Optional[str]:
+    """Convert a frame path like "data/frames/{video_id}/{filename}" to its media URL."""
+    if frame_path and frame_path.startswith(FRAME_PATH_PREFIX):
+        video_id, _, filename = frame_path[len(FRAME_PATH_PREFIX):].partition("/")
+        if filename:
+            return f"/media/frames/{video_id}/{filename}"
+    return None
+
+
+@functools.lru_cache(maxsize=QUESTION_EMBEDDING_CACHE_SIZE)
+def _embed_query(model_name: str, text: str) -> np.ndarray:
+    """
+    Embed a query with the transcript collection's model, which is model_name.
+
+    The model is part of the cache key, so embeddings are never reused across
+    embedding models.
+    """
+    SearchService._load_text_collection()
+    embedding = np.asarray(
+        SearchService._embedding_function([text])[0], dtype=np.float32
+    )
+    # The cached array is shared between requests
+    embedding.flags.writeable = False
+    return embedding
 
 
 class SearchService:
     _instance = None
+    _instance_lock = threading.Lock()
+    _embedder_lock = threading.Lock()
     _db = None
+    _embedding_function = None
     _collection = None
     _visual_collection = None
+    _segment_db = None
+    _segment_lock = threading.Lock()
+    # video_id -> ordered segment rows, least recently used first
+    _transcript_cache: OrderedDict[str, tuple] = OrderedDict()
 
     def __new__(cls):
         """Singleton pattern to ensure only one instance of EmbeddingService exists."""
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._initialize_service()
+            # Two clients on the same database would contend for its SQLite file
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._initialize_service()
+                    cls._instance = super().__new__(cls)
         return cls._instance
 
     @classmethod
     def _initialize_service(cls):
-        """Initialize the vector database with a custom embedding function."""
+        """
+        Open the vector database and the segment store.
+
+        The embedding model and the transcript collection are loaded on first
+        use (see _load_text_collection), so importing the service stays cheap.
+        """
         logger.info(f"Initializing Question Answering Service.")
         try:
             cls._db = chromadb.PersistentClient(path=CHROMA_DB_DIR)
 
-            # Create embedding function compatible with Chroma
-            embedding_function = SentenceTransformerEmbeddingFunction(
-                model_name=EMBEDDING_MODEL_NAME
-            )
-
-            cls._collection = cls._db.get_or_create_collection(
-                name=COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"},  # Use cosine similarity
-                embedding_function=embedding_function,  # Use our model for storing and querying data
-            )
-
             # Visual collection should not use an embedding function since we provide embeddings directly
             cls._visual_collection = cls._db.get_or_create_collection(
                 name=VISUAL_COLLECTION_NAME,
-                metadata={"hnsw:space": "cosine"},
+                metadata=HNSW_METADATA,
                 embedding_function=None,
             )
+            cls._apply_search_ef(cls._visual_collection)
+
+            cls._initialize_segment_store()
 
             logger.info("Question Answering Service initialized successfully.")
 
@@ -82,6 +149,204 @@ class SearchService:
             logger.error(f"Failed to initialize Question Answering Service: {e}")
             raise
 
+    @classmethod
+    def _load_text_collection(cls):
+        """
+        Load the embedding model and open the transcript collection on first use.
+
+        Chroma instantiates a collection's stored embedding function when the
+        collection is opened, so both are deferred together.
+        """
+        if cls._collection is None:
+            with cls._embedder_lock:
+                if cls._collection is None:
+                    # Imported here so deletes and keyword search never pull in torch
+                    import torch
+
+                    # Create embedding function compatible with Chroma. Chroma defaults
+                    # to the CPU, so use the GPU when present and run it in half precision
+                    embedding_function = None
+                    if torch.cuda.is_available():
+                        embedding_function = SentenceTransformerEmbeddingFunction(
+                            model_name=EMBEDDING_MODEL_NAME,
+                            device="cuda",
+                            model_kwargs={"torch_dtype": "float16"},
+                        )
+                    elif EMBEDDING_BACKEND != "torch":
+                        try:
+                            embedding_function = SentenceTransformerEmbeddingFunction(
+                                model_name=EMBEDDING_MODEL_NAME, backend=EMBEDDING_BACKEND
+                            )
+                        except Exception as e:
+                            logger.warning(
+                                f"{EMBEDDING_BACKEND} embedding backend unavailable, using torch: {e}"
+                            )
+                    if embedding_function is None:
+                        embedding_function = SentenceTransformerEmbeddingFunction(
+                            model_name=EMBEDDING_MODEL_NAME
+                        )
+
+                    collection = cls._db.get_or_create_collection(
+                        name=COLLECTION_NAME,
+                        metadata=HNSW_METADATA,
+                        embedding_function=embedding_function,  # Use our model for storing and querying data
+                    )
+                    cls._apply_search_ef(collection)
+
+                    cls._embedding_function = embedding_function
+                    cls._collection = collection
+                    logger.info(
+                        f"Loaded embedding model {EMBEDDING_MODEL_NAME} on {embedding_function.device}"
+                    )
+        return cls._collection
+
+    @classmethod
+    def _text_collection_id(cls) -> Optional[UUID]:
+        """
+        Id of the transcript collection without opening it, or None if it does not exist.
+
+        Opening a Chroma collection, even with embedding_function=None, builds
+        its stored embedding function and so loads the model. Chroma's Rust
+        bindings return the stored record without building it, so deletes and
+        counts go through the server API by id when the model is not loaded.
+        """
+        if cls._collection is not None:
+            return cls._collection.id
+        try:
+            return cls._db._server.bindings.get_collection(
+                COLLECTION_NAME, cls._db.tenant, cls._db.database
+            ).id
+        except NotFoundError:
+            return None
+
+    async def warm_up(self) -> None:
+        """Load the embedding model and run one embedding before the first request."""
+
+        def run():
+            self._load_text_collection()
+            self._embedding_function(["warm up"])
+
+        await asyncio.to_thread(run)
+        logger.info("Warmed up embedding model.")
+
+    @staticmethod
+    def _apply_search_ef(collection):
+        """Update the search ef of a collection created with a different value."""
+        hnsw_config = (collection.configuration_json or {}).get("hnsw") or {}
+        if hnsw_config.get("ef_search", HNSW_SEARCH_EF) != HNSW_SEARCH_EF:
+            collection.modify(configuration={"hnsw": {"ef_search": HNSW_SEARCH_EF}})
+            logger.info(f"Set HNSW search ef of {collection.name} to {HNSW_SEARCH_EF}")
+
+    @classmethod
+    def _initialize_segment_store(cls):
+        """
+        Open the sidecar SQLite table that mirrors transcript segments.
+
+        ChromaDB cannot order results, so segments are also kept in a table
+        indexed on (video_id, start_time) to serve ordered transcripts. A
+        trigram FTS5 index over the segment text serves keyword search.
+        """
+        cls._segment_db = sqlite3.connect(SEGMENT_DB_PATH, check_same_thread=False)
+        with cls._segment_lock, cls._segment_db:
+            has_fts = cls._segment_db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'segments_fts'"
+            ).fetchone()
+            cls._segment_db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    segment_id TEXT PRIMARY KEY,
+                    video_id TEXT NOT NULL,
+                    start_time REAL NOT NULL,
+                    end_time REAL NOT NULL,
+                    text TEXT NOT NULL
+                )
+                """
+            )
+            cls._segment_db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_segments_video_start "
+                "ON segments (video_id, start_time)"
+            )
+
+            # External-content FTS table kept in sync with the segments table by triggers
+            cls._segment_db.executescript(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+                    text, content='segments', content_rowid='rowid', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+                    INSERT INTO segments_fts(rowid, text) VALUES (new.rowid, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+                    INSERT INTO segments_fts(segments_fts, rowid, text)
+                    VALUES ('delete', old.rowid, old.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS segments_au AFTER UPDATE ON segments BEGIN
+                    INSERT INTO segments_fts(segments_fts, rowid, text)
+                    VALUES ('delete', old.rowid, old.text);
+                    INSERT INTO segments_fts(rowid, text) VALUES (new.rowid, new.text);
+                END;
+                """
+            )
+            if not has_fts:
+                cls._segment_db.execute(
+                    "INSERT INTO segments_fts(segments_fts) VALUES ('rebuild')"
+                )
+
+            stored = cls._segment_db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+        # Backfill from ChromaDB for collections indexed before the sidecar existed
+        # An empty store may be a collection from before the sidecar, so only
+        # then is the transcript collection opened during initialization
+        if stored == 0 and (collection := cls._load_text_collection()).count() > 0:
+            results = collection.get(include=["documents", "metadatas"])
+            rows = [
+                (
+                    metadata["id"],
+                    metadata["video_id"],
+                    metadata["start_time"],
+                    metadata["end_time"],
+                    document,
+                )
+                for document, metadata in zip(results["documents"], results["metadatas"])
+            ]
+            cls._insert_segment_rows(rows)
+            logger.info(f"Backfilled {len(rows)} segments into {SEGMENT_DB_PATH}")
+
+    @classmethod
+    def _insert_segment_rows(cls, rows: list[tuple]):
+        """Insert (segment_id, video_id, start_time, end_time, text) rows into the segment store."""
+        with cls._segment_lock, cls._segment_db:
+            # Upsert rather than REPLACE so the update trigger keeps the FTS index in sync
+            cls._segment_db.executemany(
+                """
+                INSERT INTO segments (segment_id, video_id, start_time, end_time, text)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (segment_id) DO UPDATE SET
+                    video_id = excluded.video_id,
+                    start_time = excluded.start_time,
+                    end_time = excluded.end_time,
+                    text = excluded.text
+                """,
+                rows,
+            )
+            for video_id in {row[1] for row in rows}:
+                cls._transcript_cache.pop(video_id, None)
+
+    def _add_in_batches(self, collection, ids: list[str], **fields):
+        """
+        Add records with as few collection.add calls as Chroma allows.
+
+        A whole video is normally one call; only videos beyond the client's
+        maximum batch size (a few thousand records) are split.
+        """
+        batch_size = self._db.get_max_batch_size()
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            collection.add(
+                ids=ids[start:end],
+                **{name: values[start:end] for name, values in fields.items()},
+            )
+
     def index_transcript(self, transcript: Transcript):
         """Index a transcript by generating embeddings of the segments and storing them in the vector database."""
 
@@ -106,7 +371,18 @@ class SearchService:
             ]
             ids = [segment.id for segment in transcript.segments]
 
-            self._collection.add(documents=documents, metadatas=metadatas, ids=ids)
+            self._add_in_batches(
+                self._load_text_collection(),
+                ids=ids,
+                documents=documents,
+                metadatas=metadatas,
+            )
+            self._insert_segment_rows(
+                [
+                    (segment.id, transcript.id, segment.start, segment.end, segment.text)
+                    for segment in transcript.segments
+                ]
+            )
             logger.info(
                 f"Indexed transcript {transcript.id} with {len(transcript.segments)} segments successfully."
             )
@@ -121,30 +397,45 @@ class SearchService:
                 logger.warning("No frame data provided for indexing visual embeddings.")
                 return
 
-            all_embeddings = []
-            all_metadatas = []
-            all_ids = []
-
-            for segment_id, frames in frame_data.items():
-                for i, frame in enumerate(frames):
-                    # Create a unique ID for each frame using index to avoid duplicates
-                    frame_id = f"{segment_id}_frame_{frame['timestamp']:.2f}_{i}"
-
-                    all_embeddings.append(frame["embedding"])
-                    all_metadatas.append(
-                        {
-                            "video_id": video_id,
-                            "segment_id": segment_id,
-                            "timestamp": frame["timestamp"],
-                            "frame_path": frame["path"],
-                        }
-                    )
-                    all_ids.append(frame_id)
+            # Flatten once, then build each column with a comprehension
+            frames = [
+                (segment_id, i, frame)
+                for segment_id, segment_frames in frame_data.items()
+                for i, frame in enumerate(segment_frames)
+            ]
+            if not frames:
+                logger.warning("No frames provided for indexing visual embeddings.")
+                return
 
-            self._visual_collection.add(
+            # Create a unique ID for each frame using index to avoid duplicates
+            all_ids = [
+                f"{segment_id}_frame_{frame['timestamp']:.2f}_{i}"
+                for segment_id, i, frame in frames
+            ]
+            all_metadatas = [
+                {
+                    "video_id": video_id,
+                    "segment_id": segment_id,
+                    "timestamp": frame["timestamp"],
+                    "frame_path": frame["path"],
+                    # Stored so searches need not convert the path per result
+                    "frame_url": _frame_url(frame["path"]) or "",
+                }
+                for segment_id, _, frame in frames
+            ]
+            # One contiguous (N, D) array instead of N Python float lists.
+            # Vectors stay float32: Chroma's HNSW index stores float32
+            # regardless of input dtype, so int8/fp16 inputs would lose
+            # precision without shrinking the index.
+            all_embeddings = np.stack(
+                [frame["embedding"] for _, _, frame in frames]
+            ).astype(np.float32, copy=False)
+
+            self._add_in_batches(
+                self._visual_collection,
+                ids=all_ids,
                 embeddings=all_embeddings,
                 metadatas=all_metadatas,
-                ids=all_ids,
             )
 
             logger.info(
@@ -155,27 +446,155 @@ class SearchService:
             logger.error(f"Failed to index visual embeddings: {e}")
             raise
 
+    def iter_segments_ordered(
+        self, video_id: str, page_size: int = SEGMENT_PAGE_SIZE
+    ) -> Iterator[TranscriptSegmentResponse]:
+        """
+        Yield the transcript segments of a video ordered by start time, page by page.
+
+        Pages are fetched with keyset pagination on (start_time, rowid), so
+        memory stays constant and the store is not locked between pages.
+        """
+        last_key = (float("-inf"), -1)
+        while True:
+            with self._segment_lock:
+                rows = self._segment_db.execute(
+                    "SELECT rowid, segment_id, start_time, end_time, text FROM segments "
+                    "WHERE video_id = ? AND (start_time, rowid) > (?, ?) "
+                    "ORDER BY start_time, rowid LIMIT ?",
+                    (video_id, *last_key, page_size),
+                ).fetchall()
+
+            for _, segment_id, start_time, end_time, text in rows:
+                yield TranscriptSegmentResponse.model_construct(
+                    segment_id=segment_id,
+                    start_time=start_time,
+                    end_time=end_time,
+                    text=text,
+                )
+
+            if len(rows) < page_size:
+                return
+            last_key = (rows[-1][2], rows[-1][0])
+
+    def _get_segment_rows(self, segment_ids: list[str]) -> list[tuple]:
+        """Fetch (segment_id, video_id, start_time, end_time, text) rows by segment id."""
+        if not segment_ids:
+            return []
+        with self._segment_lock:
+            return self._segment_db.execute(
+                "SELECT segment_id, video_id, start_time, end_time, text FROM segments "
+                f"WHERE segment_id IN ({', '.join('?' * len(segment_ids))})",
+                segment_ids,
+            ).fetchall()
+
+    def _get_video_segment_rows(self, video_ids: Optional[list[str]]) -> list[tuple]:
+        """
+        Fetch (segment_id, video_id, start_time, end_time, text) rows of the
+        given videos (all videos if None), ordered by start time.
+        """
+        if not video_ids:
+            with self._segment_lock:
+                return self._segment_db.execute(
+                    "SELECT segment_id, video_id, start_time, end_time, text "
+                    "FROM segments ORDER BY start_time, rowid"
+                ).fetchall()
+
+        if len(video_ids) == 1:
+            return list(self._get_cached_video_rows(video_ids[0]))
+        # Each video's rows are already ordered, so merge them by start time
+        return list(
+            heapq.merge(
+                *(self._get_cached_video_rows(video_id) for video_id in video_ids),
+                key=itemgetter(2),
+            )
+        )
+
+    def _get_cached_video_rows(self, video_id: str) -> tuple:
+        """Get the ordered segment rows of one video, reading the store on a cache miss."""
+        with self._segment_lock:
+            rows = self._transcript_cache.get(video_id)
+            if rows is not None:
+                self._transcript_cache.move_to_end(video_id)
+                return rows
+
+            rows = tuple(
+                self._segment_db.execute(
+                    "SELECT segment_id, video_id, start_time, end_time, text FROM segments "
+                    "WHERE video_id = ? ORDER BY start_time, rowid",
+                    (video_id,),
+                )
+            )
+            # Unknown videos are not cached, so a later index of them is seen
+            if rows and TRANSCRIPT_CACHE_SIZE > 0:
+                self._transcript_cache[video_id] = rows
+                while len(self._transcript_cache) > TRANSCRIPT_CACHE_SIZE:
+                    self._transcript_cache.popitem(last=False)
+            return rows
+
+    def get_transcript_summary(self, video_id: str) -> tuple[Optional[str], int]:
+        """Get the full transcript text and segment count of a video in a single query."""
+        rows = self._get_cached_video_rows(video_id)
+
+        if not rows:
+            return None, 0
+        return " ".join(row[4] for row in rows), len(rows)
+
+    def delete_transcript(self, video_id: str):
+        """Delete all transcript segments of a video from ChromaDB and the segment store."""
+        collection_id = self._text_collection_id()
+        if collection_id is not None:
+            self._db._server._delete(
+                collection_id=collection_id,
+                where={"video_id": video_id},
+                tenant=self._db.tenant,
+                database=self._db.database,
+            )
+        with self._segment_lock, self._segment_db:
+            self._segment_db.execute("DELETE FROM segments WHERE video_id = ?", (video_id,))
+            self._transcript_cache.pop(video_id, None)
+
+    def clear_transcripts(self) -> int:
+        """Delete all transcript segments from ChromaDB and the segment store."""
+        collection_id = self._text_collection_id()
+        if collection_id is None:
+            deleted_count = 0
+        else:
+            deleted_count = self._db._server._count(
+                collection_id=collection_id,
+                tenant=self._db.tenant,
+                database=self._db.database,
+            )
+        if deleted_count:
+            # Every segment carries a video_id, so this matches the whole collection
+            self._db._server._delete(
+                collection_id=collection_id,
+                where={"video_id": {"$ne": ""}},
+                tenant=self._db.tenant,
+                database=self._db.database,
+            )
+        with self._segment_lock, self._segment_db:
+            self._segment_db.execute("DELETE FROM segments")
+            self._transcript_cache.clear()
+        return deleted_count
+
+    def clear_visual_embeddings(self) -> int:
+        """Delete all visual embeddings from ChromaDB."""
+        deleted_count = self._visual_collection.count()
+        if deleted_count:
+            self._visual_collection.delete(where={"video_id": {"$ne": ""}})
+        return deleted_count
+
     def get_transcript_text_by_video_id(self, video_id: str) -> Optional[str]:
         """Retrieve the full text of a transcript by its video ID by reconstructing from segments."""
         try:
             logger.info(f"Retrieving transcript text for video ID: {video_id}")
-            where_filter = {"video_id": video_id}
-
-            results = self._collection.get(where=where_filter)
-            if not results or not results["documents"]:
+            # The segment store returns the segments already ordered by start time
+            full_transcript, _ = self.get_transcript_summary(video_id)
+            if full_transcript is None:
                 logger.warning(f"No segments found for video ID: {video_id}")
                 return None
 
-            documents = results["documents"]
-            metadatas = results["metadatas"]
-
-            # Sort segments by start time to ensure proper order
-            segment_pairs = list(zip(documents, metadatas))
-            segment_pairs.sort(key=lambda x: x[1]["start_time"])
-
-            # Reconstruct full transcript by joining segments
-            full_transcript = " ".join([segment[0] for segment in segment_pairs])
-
             logger.info(
                 f"Successfully reconstructed transcript for video ID: {video_id}"
             )
@@ -185,6 +604,10 @@ class SearchService:
             logger.error(f"Failed to retrieve transcript text: {e}")
             raise
 
+    def _embed_question(self, question: str) -> np.ndarray:
+        """Embed a question with the collection's model; repeated questions hit the cache."""
+        return _embed_query(EMBEDDING_MODEL_NAME, question)
+
     def _build_where_filter(self, video_ids: Optional[list[str]]) -> Optional[dict]:
         """Build ChromaDB where filter for video IDs."""
         if not video_ids:
@@ -193,10 +616,13 @@ class SearchService:
             return {"video_id": video_ids[0]}
         return {"video_id": {"$in": video_ids}}
 
-    def _get_video_title(self, video_id: str) -> str:
-        """Get video title from video library."""
-        video = video_library_service.get_video(video_id)
-        return video.title if video else video_id
+    def _get_video_titles(self, video_ids: Iterable[str]) -> dict[str, str]:
+        """Get the titles of the given videos from the video library, once per video."""
+        titles = {}
+        for video_id in set(video_ids):
+            video = video_library_service.get_video(video_id)
+            titles[video_id] = video.title if video else video_id
+        return titles
 
     def query_transcript(
         self,
@@ -224,6 +650,29 @@ class SearchService:
             )
             return self._keyword_search(question, video_ids, top_k)
 
+    async def aquery_transcript(
+        self,
+        question: str,
+        video_ids: Optional[list[str]] = None,
+        top_k: Optional[int] = 5,
+        search_type: Optional[SearchType] = SearchType.KEYWORD,
+    ) -> QuestionResponse:
+        """
+        Async variant of query_transcript for request handlers.
+
+        ChromaDB and SQLite work runs in worker threads, off the event loop;
+        LLM answers are awaited so concurrent questions can be batched.
+        """
+        if search_type == SearchType.LLM:
+            logger.info(
+                f"Querying transcripts with {search_type} search for question: {question}"
+            )
+            logger.info(f"Video IDs filter: {video_ids if video_ids else 'all videos'}")
+            return await self._allm_search(question, video_ids, top_k)
+        return await asyncio.to_thread(
+            self.query_transcript, question, video_ids, top_k, search_type
+        )
+
     def _keyword_search(
         self, question: str, video_ids: Optional[list[str]], top_k: Optional[int] = None
     ) -> KeywordSearchResponse:
@@ -232,47 +681,27 @@ class SearchService:
         try:
             logger.info(f"Performing keyword search for question: {question}")
 
-            # Get all segments for the specified videos
-            where_filter = self._build_where_filter(video_ids)
+            matches = self._find_keyword_segments(question, video_ids, top_k)
 
-            results = self._collection.get(where=where_filter)
-
-            if not results or not results["documents"]:
-                logger.warning(f"No segments found for video IDs: {video_ids}")
-                return KeywordSearchResponse(
-                    question=question, video_ids=video_ids, results=[]
-                )
-
-            documents = results["documents"]
-            metadatas = results["metadatas"]
-
-            # Filter documents based on keyword match and keep track of indices
-            filtered_results = [
-                (i, doc)
-                for i, doc in enumerate(documents)
-                if question.lower() in doc.lower()
-            ]
-
-            if not filtered_results:
+            if not matches:
                 logger.warning(f"No keyword matches found for question: {question}")
                 return KeywordSearchResponse(
                     question=question, video_ids=video_ids, results=[]
                 )
 
-            if top_k:
-                filtered_results = filtered_results[:top_k]
-
+            titles = self._get_video_titles(row[1] for row in matches)
+            # Rows come from our own segment store, so skip per-field validation
             query_results = [
-                QueryResult(
-                    segment_id=metadatas[i]["id"],
-                    start_time=metadatas[i]["start_time"],
-                    end_time=metadatas[i]["end_time"],
-                    text=document,
-                    video_id=metadatas[i]["video_id"],
-                    video_title=self._get_video_title(metadatas[i]["video_id"]),
+                QueryResult.model_construct(
+                    segment_id=segment_id,
+                    start_time=start_time,
+                    end_time=end_time,
+                    text=text,
+                    video_id=video_id,
+                    video_title=titles[video_id],
                     relevance_score=None,
                 )
-                for i, document in filtered_results
+                for segment_id, video_id, start_time, end_time, text in matches
             ]
 
             logger.info(
@@ -288,10 +717,79 @@ class SearchService:
             logger.error(f"Failed to perform keyword search: {e}")
             raise
 
+    def _find_keyword_segments(
+        self, question: str, video_ids: Optional[list[str]], top_k: Optional[int]
+    ) -> list[tuple]:
+        """
+        Find segments containing the question as a case-insensitive substring.
+
+        Returns (segment_id, video_id, start_time, end_time, text) rows in index order.
+        """
+        params: list = []
+        video_clause = ""
+        if video_ids:
+            video_clause = f" AND s.video_id IN ({', '.join('?' * len(video_ids))})"
+
+        if len(question) >= TRIGRAM_MIN_LENGTH:
+            # A quoted trigram phrase matches any substring of the text
+            phrase = '"' + question.replace('"', '""') + '"'
+            sql = (
+                "SELECT s.segment_id, s.video_id, s.start_time, s.end_time, s.text "
+                "FROM segments_fts JOIN segments s ON s.rowid = segments_fts.rowid "
+                "WHERE segments_fts MATCH ?" + video_clause + " ORDER BY s.rowid"
+            )
+            params = [phrase, *(video_ids or [])]
+            if top_k:
+                sql += " LIMIT ?"
+                params.append(top_k)
+
+            with self._segment_lock:
+                return self._segment_db.execute(sql, params).fetchall()
+
+        # Too short for the trigram index. LIKE folds ASCII case only, so
+        # SQLite can scan ASCII needles itself; others are matched in Python.
+        if question.isascii():
+            escaped = (
+                question.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            )
+            sql = (
+                "SELECT s.segment_id, s.video_id, s.start_time, s.end_time, s.text "
+                "FROM segments s WHERE s.text LIKE ? ESCAPE '\\'"
+                + video_clause
+                + " ORDER BY s.rowid"
+            )
+            params = [f"%{escaped}%", *(video_ids or [])]
+            if top_k:
+                sql += " LIMIT ?"
+                params.append(top_k)
+
+            with self._segment_lock:
+                return self._segment_db.execute(sql, params).fetchall()
+
+        sql = (
+            "SELECT s.segment_id, s.video_id, s.start_time, s.end_time, s.text "
+            "FROM segments s WHERE 1 = 1" + video_clause + " ORDER BY s.rowid"
+        )
+        with self._segment_lock:
+            rows = self._segment_db.execute(sql, video_ids or []).fetchall()
+
+        # A case-insensitive pattern avoids lowercasing a copy of every segment
+        search = re.compile(re.escape(question), re.IGNORECASE).search
+        matches = (row for row in rows if search(row[4]))
+        return list(islice(matches, top_k) if top_k else matches)
+
     def _semantic_search(
-        self, question: str, video_ids: Optional[list[str]], top_k: Optional[int] = 5
+        self,
+        question: str,
+        video_ids: Optional[list[str]],
+        top_k: Optional[int] = 5,
+        query_embedding: Optional[np.ndarray] = None,
     ) -> SemanticSearchResponse:
-        """Perform a semantic search on the vector database using embeddings."""
+        """
+        Perform a semantic search on the vector database using embeddings.
+
+        The question is embedded unless query_embedding is given.
+        """
 
         try:
             logger.info(f"Performing semantic search for question: {question}")
@@ -299,8 +797,13 @@ class SearchService:
             # Restrict results to specific videos if video_ids is provided
             where_filter = self._build_where_filter(video_ids)
 
-            results = self._collection.query(
-                query_texts=[question], n_results=top_k, where=where_filter
+            if query_embedding is None:
+                query_embedding = self._embed_question(question)
+            results = self._load_text_collection().query(
+                query_embeddings=[query_embedding],
+                n_results=top_k,
+                where=where_filter,
+                include=["documents", "metadatas", "distances"],
             )
             documents = (
                 results["documents"][0] if results and results["documents"] else []
@@ -316,14 +819,16 @@ class SearchService:
 
             metadatas = results["metadatas"][0]
 
+            titles = self._get_video_titles(metadata["video_id"] for metadata in metadatas)
+            # Chroma returns our own metadata, so skip per-field validation
             query_results = [
-                QueryResult(
+                QueryResult.model_construct(
                     segment_id=metadatas[i]["id"],
                     start_time=metadatas[i]["start_time"],
                     end_time=metadatas[i]["end_time"],
                     text=document,
                     video_id=metadatas[i]["video_id"],
-                    video_title=self._get_video_title(metadatas[i]["video_id"]),
+                    video_title=titles[metadatas[i]["video_id"]],
                     relevance_score=round((1 - distances[i]) * 100, 2),
                 )
                 for i, document in enumerate(documents)
@@ -348,66 +853,133 @@ class SearchService:
         """Use an LLM to synthesize an answer from semantic search results."""
 
         try:
-            # First, get semantic search results (for returning in response)
-            semantic_search_response: SemanticSearchResponse = self._semantic_search(
-                question, video_ids, top_k
+            semantic_search_response, all_segments, query_embedding = (
+                self._prepare_llm_search(question, video_ids, top_k)
             )
+            if not all_segments:
+                return self._no_transcript_response(question, video_ids)
 
-            # Second, get all segments for the videos (for LLM context)
-            where_filter = self._build_where_filter(video_ids)
-            all_segments_result = self._collection.get(where=where_filter)
-
-            if not all_segments_result or not all_segments_result["documents"]:
-                logger.warning(f"No transcript found for LLM synthesis: {question}")
-                return LLMSearchResponse(
-                    question=question,
-                    video_ids=video_ids,
-                    results=[],
-                    summary="No transcript found.",
-                    not_addressed=True,
-                    model_id="none",
-                )
-
-            # Convert all segments to QueryResult format and sort by start time
-            all_segments = []
-            for i, doc in enumerate(all_segments_result["documents"]):
-                metadata = all_segments_result["metadatas"][i]
-                all_segments.append(
-                    QueryResult(
-                        segment_id=metadata["id"],
-                        start_time=metadata["start_time"],
-                        end_time=metadata["end_time"],
-                        text=doc,
-                        video_id=metadata["video_id"],
-                        video_title=self._get_video_title(metadata["video_id"]),
-                        relevance_score=None,
-                    )
-                )
-
-            # Sort by start time to maintain chronological order
-            all_segments.sort(key=lambda x: x.start_time)
+            # Pass all segments to LLM for synthesis
+            answer: LlmAnswer = llm_service.generate_answer(
+                question, all_segments, query_embedding=query_embedding
+            )
+            return self._llm_search_response(
+                question, video_ids, answer, semantic_search_response
+            )
 
-            logger.info(f"Generating LLM synthesis for question: {question}")
-            logger.info(f"Using {len(all_segments)} segments for full context")
+        except Exception as e:
+            logger.error(f"Error generating LLM response: {e}")
+            raise
 
-            # Pass all segments to LLM for synthesis
-            answer: LlmAnswer = llm_service.generate_answer(question, all_segments)
+    async def _allm_search(
+        self, question: str, video_ids: Optional[list[str]], top_k: Optional[int] = 5
+    ) -> LLMSearchResponse:
+        """
+        Async variant of _llm_search.
 
-            answer_response = LLMSearchResponse(
-                question=question,
-                video_ids=video_ids,
-                summary=answer.summary,
-                not_addressed=answer.not_addressed,
-                model_id=answer.model_id,
-                results=semantic_search_response.results,
+        Retrieval runs in a worker thread and the answer is awaited, so questions
+        from concurrent requests can share one LLM batch.
+        """
+        try:
+            semantic_search_response, all_segments, query_embedding = (
+                await asyncio.to_thread(
+                    self._prepare_llm_search, question, video_ids, top_k
+                )
             )
+            if not all_segments:
+                return self._no_transcript_response(question, video_ids)
 
-            return answer_response
+            answer: LlmAnswer = await llm_service.agenerate_answer(
+                question, all_segments, query_embedding=query_embedding
+            )
+            return self._llm_search_response(
+                question, video_ids, answer, semantic_search_response
+            )
 
         except Exception as e:
             logger.error(f"Error generating LLM response: {e}")
             raise
 
+    def _prepare_llm_search(
+        self, question: str, video_ids: Optional[list[str]], top_k: Optional[int]
+    ) -> tuple[SemanticSearchResponse, list[QueryResult], np.ndarray]:
+        """
+        Retrieve what an LLM answer needs: the semantic results returned to the
+        caller, every transcript segment as context and the question embedding.
+        """
+        # Get all segments for the videos (for LLM context) from the
+        # sidecar, already in chronological order, during the vector query
+        segment_rows_future = search_executor.submit(
+            self._get_video_segment_rows, video_ids
+        )
+
+        # Embed the question once for both retrieval and the answer cache
+        query_embedding = self._embed_question(question)
+
+        # Get semantic search results (for returning in response)
+        semantic_search_response: SemanticSearchResponse = self._semantic_search(
+            question, video_ids, top_k, query_embedding
+        )
+
+        segment_rows = segment_rows_future.result()
+
+        # Semantic scores let the LLM service keep the most relevant
+        # segments if the full transcript exceeds its context window
+        relevance_scores = {
+            result.segment_id: result.relevance_score
+            for result in semantic_search_response.results
+        }
+
+        # Convert all segments to QueryResult format; rows come from our own
+        # store, so skip per-field validation. These segments only feed the
+        # prompt and are not returned, so their video titles are not resolved.
+        all_segments = [
+            QueryResult.model_construct(
+                segment_id=segment_id,
+                start_time=start_time,
+                end_time=end_time,
+                text=text,
+                video_id=video_id,
+                relevance_score=relevance_scores.get(segment_id),
+            )
+            for segment_id, video_id, start_time, end_time, text in segment_rows
+        ]
+
+        if all_segments:
+            logger.info(f"Generating LLM synthesis for question: {question}")
+            logger.info(f"Using {len(all_segments)} segments for full context")
+        return semantic_search_response, all_segments, query_embedding
+
+    @staticmethod
+    def _no_transcript_response(
+        question: str, video_ids: Optional[list[str]]
+    ) -> LLMSearchResponse:
+        logger.warning(f"No transcript found for LLM synthesis: {question}")
+        return LLMSearchResponse(
+            question=question,
+            video_ids=video_ids,
+            results=[],
+            summary="No transcript found.",
+            not_addressed=True,
+            model_id="none",
+        )
+
+    @staticmethod
+    def _llm_search_response(
+        question: str,
+        video_ids: Optional[list[str]],
+        answer: LlmAnswer,
+        semantic_search_response: SemanticSearchResponse,
+    ) -> LLMSearchResponse:
+        return LLMSearchResponse(
+            question=question,
+            video_ids=video_ids,
+            summary=answer.summary,
+            not_addressed=answer.not_addressed,
+            model_id=answer.model_id,
+            results=semantic_search_response.results,
+        )
+
     def _visual_search(
         self, question: str, video_ids: Optional[list[str]], top_k: Optional[int] = 5
     ) -> VisualSearchResponse:
@@ -431,6 +1003,8 @@ class SearchService:
                     top_k * 3
                 ),  # Fetch more to ensure we get enough unique segments
                 where=where_filter,
+                # Segment text comes from the sidecar, so frame documents are not needed
+                include=["metadatas", "distances"],
             )
 
             logger.info(
@@ -456,20 +1030,21 @@ class SearchService:
                 f"Returning top {top_k} unique visual segments based on frame matches."
             )
 
-            # Store best frame for each segment
-            top_k_segments = {}  # segment_id -> (distance, frame_metadata)
-            for i, metadata in enumerate(metadatas):
+            # Store best frame for each segment, independent of result order
+            best_frames = {}  # segment_id -> (distance, frame_metadata)
+            for distance, metadata in zip(distances, metadatas):
                 segment_id = metadata["segment_id"]
-                if segment_id not in top_k_segments:
-                    top_k_segments[segment_id] = (distances[i], metadata)
-                    if len(top_k_segments) >= top_k:
-                        break
-
-            segment_results = self._collection.get(
-                ids=list(top_k_segments.keys()), where=where_filter
+                best = best_frames.get(segment_id)
+                if best is None or distance < best[0]:
+                    best_frames[segment_id] = (distance, metadata)
+            top_k_segments = dict(
+                heapq.nsmallest(top_k, best_frames.items(), key=lambda item: item[1][0])
             )
 
-            if not segment_results or not segment_results["documents"]:
+            # The sidecar answers an id lookup without another Chroma round trip
+            segment_rows = self._get_segment_rows(list(top_k_segments.keys()))
+
+            if not segment_rows:
                 logger.warning(
                     f"No visual segment matches found for question: {question}"
                 )
@@ -477,54 +1052,36 @@ class SearchService:
                     question=question, video_ids=video_ids, results=[]
                 )
 
-            segment_documents = (
-                segment_results["documents"]
-                if segment_results and segment_results["documents"]
-                else []
-            )
-
-            segment_metadatas = segment_results["metadatas"]
-
+            titles = self._get_video_titles(row[1] for row in segment_rows)
+            # Segment rows and frame metadata are our own, so skip per-field validation
             query_results = []
-            for i, document in enumerate(segment_documents):
-                segment_id = segment_metadatas[i]["id"]
-                distance, frame_metadata = top_k_segments[segment_id]
-                video_id = segment_metadatas[i]["video_id"]
-
-                # Convert file system path to URL
-                frame_path = frame_metadata.get("frame_path")
-                frame_url = None
-                if frame_path:
-                    # Extract video_id and filename from path like "data/frames/{video_id}/{filename}"
-                    path_parts = frame_path.split("/")
-                    if (
-                        len(path_parts) >= 4
-                        and path_parts[0] == "data"
-                        and path_parts[1] == "frames"
-                    ):
-                        vid_id = path_parts[2]
-                        filename = path_parts[3]
-                        frame_url = f"/media/frames/{vid_id}/{filename}"
+            rows_by_id = {row[0]: row for row in segment_rows}
+            # top_k_segments is ordered by distance, so results come out by relevance
+            for segment_id, (distance, frame_metadata) in top_k_segments.items():
+                row = rows_by_id.get(segment_id)
+                if row is None:
+                    continue
+                _, video_id, start_time, end_time, document = row
+
+                # Frames indexed before the URL was stored only carry their path
+                frame_url = frame_metadata.get("frame_url") or _frame_url(
+                    frame_metadata.get("frame_path")
+                )
 
                 query_results.append(
-                    QueryResult(
+                    QueryResult.model_construct(
                         segment_id=segment_id,
-                        start_time=segment_metadatas[i]["start_time"],
-                        end_time=segment_metadatas[i]["end_time"],
+                        start_time=start_time,
+                        end_time=end_time,
                         text=document,
                         video_id=video_id,
-                        video_title=self._get_video_title(video_id),
+                        video_title=titles[video_id],
                         relevance_score=round((1 - distance) * 100, 2),
                         frame_timestamp=frame_metadata.get("timestamp"),
                         frame_path=frame_url,
                     )
                 )
 
-            # Sort by relevance score in descending order
-            query_results = sorted(
-                query_results, key=lambda x: x.relevance_score, reverse=True
-            )
-
             logger.info(
                 f"Found {len(query_results)} visual segment matches for question: {question}"
             )
@@ -1,16 +1,11 @@
 import os
-import re
 import logging
+from typing import Iterator
 from openai import OpenAI
 from dotenv import load_dotenv
 
 from app.services.search import search_service
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -29,6 +24,9 @@ else:
 
 MODEL_NAME = os.getenv("SUMMARIZATION_MODEL", "qwen3:8b")
 
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
 # Initialize OpenAI client
 client = OpenAI(
     base_url=BASE_URL,
@@ -95,9 +93,22 @@ def summarize_by_video_id(video_id: str) -> str:
 
 def call_llm(prompt: str) -> str:
     """Call LLM API using OpenAI client for text generation."""
+    # Remove any leading/trailing whitespace or empty lines
+    return "".join(stream_llm(prompt)).strip()
+
+
+def stream_llm(prompt: str) -> Iterator[str]:
+    """
+    Stream the generated summary text, dropping <think> blocks as they arrive.
+
+    Tags may be split across chunks, so text that could start a tag is held
+    back until the next chunk decides it. If the output ends inside a think
+    block before any summary text, the text after <think> is returned instead
+    of an empty summary.
+    """
     try:
         # Use chat completion API
-        response = client.chat.completions.create(
+        with client.chat.completions.create(
             model=MODEL_NAME,
             messages=[
                 {
@@ -109,23 +120,63 @@ def call_llm(prompt: str) -> str:
             temperature=0.3,  # Slightly higher for more natural summaries
             top_p=0.9,
             max_tokens=1024,  # Reasonable limit for summaries
-        )
-
-        # Extract and return the generated text
-        summary = response.choices[0].message.content.strip()
-
-        # Clean up any thinking tags or meta-commentary
-        if "<think>" in summary:
-            # Remove everything between <think> and </think>
-            summary = re.sub(
-                r"<think>.*?</think>", "", summary, flags=re.DOTALL
-            ).strip()
-
-        # Remove any leading/trailing whitespace or empty lines
-        summary = summary.strip()
-
-        return summary
+            stream=True,
+        ) as stream:
+            pending = ""
+            in_think = False
+            # Content of the open think block and whether any text was yielded
+            thought = ""
+            answered = False
+            for chunk in stream:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                pending += text
+                while pending:
+                    if in_think:
+                        end = pending.find(_THINK_CLOSE)
+                        if end == -1:
+                            held = min(len(pending), len(_THINK_CLOSE) - 1)
+                            thought += pending[: len(pending) - held]
+                            pending = pending[len(pending) - held :]
+                            break
+                        pending = pending[end + len(_THINK_CLOSE) :]
+                        thought = ""
+                        in_think = False
+                        continue
+
+                    start = pending.find(_THINK_OPEN)
+                    if start != -1:
+                        if start:
+                            answered = True
+                            yield pending[:start]
+                        pending = pending[start + len(_THINK_OPEN) :]
+                        in_think = True
+                        continue
+
+                    held = _partial_tag_length(pending, _THINK_OPEN)
+                    if held < len(pending):
+                        answered = True
+                        yield pending[: len(pending) - held]
+                    pending = pending[len(pending) - held :]
+                    break
+
+            if in_think:
+                # Ran out of tokens while thinking; the thought beats no summary
+                if not answered:
+                    logger.warning("LLM output ended inside an unclosed <think> block")
+                    yield thought + pending
+            elif pending:
+                yield pending
 
     except Exception as e:
         logger.error(f"Failed to call LLM: {e}")
         raise
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of tag."""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
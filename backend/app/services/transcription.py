@@ -4,47 +4,172 @@ import shutil
 import subprocess
 import asyncio
 import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
 import torch
 import whisper
-from typing import Dict
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+from app.services.trash import discard_file
+
+try:
+    from faster_whisper import BatchedInferencePipeline, WhisperModel
+except ImportError:  # optional: pip install faster-whisper
+    BatchedInferencePipeline = WhisperModel = None
+
 logger = logging.getLogger(__name__)
 
-model_cache: Dict[str, whisper.Whisper] = {}
 DEFAULT_MODEL = "small"
+# Comma-separated Whisper models to load and warm up at startup
+PRELOAD_MODELS = [
+    name.strip()
+    for name in os.getenv("PRELOAD_MODELS", DEFAULT_MODEL).split(",")
+    if name.strip()
+]
+# Upper bound on resident Whisper models; the least recently used one is evicted
+MAX_CACHED_MODELS = max(int(os.getenv("MAX_CACHED_MODELS", "2")), len(PRELOAD_MODELS))
+
+# "whisper" (reference PyTorch) or "faster-whisper" (CTranslate2, float16 on
+# GPU and int8 on CPU; requires the faster-whisper package)
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "whisper").lower()
+if WHISPER_BACKEND == "faster-whisper" and WhisperModel is None:
+    logger.warning("faster-whisper is not installed, using the reference Whisper backend")
+    WHISPER_BACKEND = "whisper"
+# faster-whisper on GPU: 30 s windows of one file encoded per forward pass (1 disables)
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "16"))
+
+# Minimum decoded audio accepted for transcription (0.1 s at Whisper's sample rate)
+MIN_AUDIO_SAMPLES = whisper.audio.SAMPLE_RATE // 10
+
+# Reference backend on GPU: compile the encoder into CUDA graphs for its fixed 30 s windows
+WHISPER_COMPILE_ENCODER = os.getenv("WHISPER_COMPILE_ENCODER", "true").lower() == "true"
+
+# Return cached GPU memory to the driver after every transcription: slightly slower
+# transcriptions, but fewer out-of-memory errors when several models share a small GPU
+WHISPER_EMPTY_CUDA_CACHE = os.getenv("WHISPER_EMPTY_CUDA_CACHE", "false").lower() == "true"
+
+# Transcription requests flushed together, and how long the first one waits for company
+TRANSCRIPTION_BATCH_SIZE = int(os.getenv("TRANSCRIPTION_BATCH_SIZE", "4"))
+TRANSCRIPTION_BATCH_WINDOW = 0.025
+
+# Loaded models stay resident across transcriptions, ordered by last use
+model_cache: "OrderedDict[str, Union[whisper.Whisper, WhisperModel, BatchedInferencePipeline]]" = OrderedDict()
+
+# Whisper's encoder always sees 30 s mel windows, so cuDNN can keep the fastest
+# convolution algorithm it finds during warm-up
+if torch.cuda.is_available():
+    torch.backends.cudnn.benchmark = True
 
 # Lock to ensure only one transcription runs at a time (Whisper is not thread-safe)
 _transcription_lock = threading.Lock()
 
 
-def get_model(model_name: str = DEFAULT_MODEL) -> whisper.Whisper:
+def get_model(
+    model_name: str = DEFAULT_MODEL,
+) -> "Union[whisper.Whisper, WhisperModel, BatchedInferencePipeline]":
     try:
-        if model_name not in model_cache:
-            logger.info(
-                f"Model not found in cache. Loading Whisper {model_name} model."
+        if model_name in model_cache:
+            model_cache.move_to_end(model_name)
+            return model_cache[model_name]
+
+        logger.info(f"Model not found in cache. Loading Whisper {model_name} model.")
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        logger.info(f"Loading model on {device}")
+        if WHISPER_BACKEND == "faster-whisper":
+            model = WhisperModel(
+                model_name,
+                device=device,
+                compute_type="float16" if device == "cuda" else "int8",
             )
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            logger.info(f"Loading model on {device}")
-            model_cache[model_name] = whisper.load_model(model_name, device=device)
+            # Batching windows only pays off on the GPU
+            if device == "cuda" and WHISPER_BATCH_SIZE > 1:
+                model = BatchedInferencePipeline(model=model)
+            model_cache[model_name] = model
+        else:
+            model = whisper.load_model(model_name, device=device)
+            if device == "cuda" and WHISPER_COMPILE_ENCODER:
+                _compile_encoder(model)
+            model_cache[model_name] = model
+
+        # Only evict when a new model is requested and the cache is full
+        while len(model_cache) > MAX_CACHED_MODELS:
+            evicted_name, _ = model_cache.popitem(last=False)
+            logger.info(f"Evicted least recently used Whisper model: {evicted_name}")
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
         return model_cache[model_name]
     except Exception as e:
         logger.error(f"Error loading model: {e}")
         raise RuntimeError(f"Model loading failed: {e}")
 
 
-def transcribe_audio(audio_path: str, model_name: str, language: str) -> dict:
+def _compile_encoder(model: "whisper.Whisper") -> None:
     """
-    Transcribe audio using Whisper model.
+    Compile the encoder with CUDA graphs and trigger the capture once.
 
-    Uses a lock to ensure thread-safety since Whisper/PyTorch models
-    are not safe to use concurrently from multiple threads.
+    transcribe() always feeds the encoder (1, n_mels, 3000) float16 windows, so a
+    single capture is replayed for every window. Older torch versions or failed
+    captures keep the eager encoder.
     """
-    # Verify audio file exists and has content before acquiring lock
+    encoder = model.encoder
+    try:
+        model.encoder = torch.compile(encoder, mode="reduce-overhead", fullgraph=True)
+        example = torch.zeros(
+            1, model.dims.n_mels, whisper.audio.N_FRAMES,
+            dtype=torch.float16, device=model.device,
+        )
+        with torch.no_grad():
+            model.encoder(example)
+        logger.info("Compiled Whisper encoder with CUDA graphs")
+    except Exception as e:
+        model.encoder = encoder
+        logger.warning(f"Whisper encoder compilation failed, using eager encoder: {e}")
+
+
+def warm_up_model(model_name: str = DEFAULT_MODEL) -> None:
+    """
+    Load a model and run one second of silence through it so that weights are
+    resident and kernels are initialized before the first real transcription.
+    """
+    with _transcription_lock:
+        model = get_model(model_name)
+        silence = np.zeros(whisper.audio.SAMPLE_RATE, dtype=np.float32)
+        _run_model(model, silence, "en")
+    logger.info(f"Warmed up Whisper {model_name} model.")
+
+
+def _run_model(model, audio: Union[str, np.ndarray], language: Optional[str]) -> dict:
+    """Transcribe with either backend and return Whisper's result dict shape."""
+    if WhisperModel is None or isinstance(model, whisper.Whisper):
+        return model.transcribe(audio, language=language)
+
+    # faster-whisper yields segments lazily; voice activity detection skips
+    # silence and, when batched, splits the audio into chunks of up to 30 s
+    if isinstance(model, BatchedInferencePipeline):
+        segments, info = model.transcribe(
+            audio, language=language, beam_size=5, batch_size=WHISPER_BATCH_SIZE
+        )
+    else:
+        segments, info = model.transcribe(
+            audio, language=language, beam_size=5, vad_filter=True
+        )
+    segments = [
+        {"id": segment.id, "start": segment.start, "end": segment.end, "text": segment.text}
+        for segment in segments
+    ]
+    return {
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+        "language": info.language,
+    }
+
+
+def _check_audio_file(audio_path: str) -> None:
+    """Verify the audio file exists and has content before it reaches Whisper."""
     if not os.path.exists(audio_path):
         raise RuntimeError(f"Audio file does not exist: {audio_path}")
 
@@ -52,13 +177,28 @@ def transcribe_audio(audio_path: str, model_name: str, language: str) -> dict:
     if file_size < 1000:
         raise RuntimeError(f"Audio file is too small ({file_size} bytes), cannot transcribe")
 
+
+def transcribe_audio(
+    audio: Union[str, np.ndarray], model_name: str, language: Optional[str]
+) -> dict:
+    """
+    Transcribe audio using Whisper model.
+
+    Accepts an audio file path or a 16kHz waveform already decoded with
+    whisper.load_audio. Uses a lock to ensure thread-safety since
+    Whisper/PyTorch models are not safe to use concurrently from multiple threads.
+    """
+    # Verify audio file exists and has content before acquiring lock
+    if isinstance(audio, str):
+        _check_audio_file(audio)
+
     # Acquire lock for model loading and transcription
     logger.info(f"Waiting for transcription lock (model: {model_name})...")
     with _transcription_lock:
         try:
             logger.info(f"Transcribing audio using model {model_name}...")
             model = get_model(model_name)
-            result = model.transcribe(audio_path, language=language)
+            result = _run_model(model, audio, language)
             logger.info("Transcription completed successfully.")
             return result
         except Exception as e:
@@ -72,6 +212,120 @@ def transcribe_audio(audio_path: str, model_name: str, language: str) -> dict:
                 raise RuntimeError(f"GPU error during transcription: {error_msg}")
             else:
                 raise RuntimeError(f"Transcription failed: {error_msg}")
+        finally:
+            if WHISPER_EMPTY_CUDA_CACHE and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+
+class TranscriptionBatcher:
+    """
+    Collects transcription requests and runs them as batches on one Whisper thread.
+
+    Requests arriving within TRANSCRIPTION_BATCH_WINDOW of each other (up to
+    TRANSCRIPTION_BATCH_SIZE) are flushed together: their audio is decoded
+    concurrently while Whisper is busy, then the batch is transcribed grouped
+    by model so a model is loaded at most once per batch.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = TRANSCRIPTION_BATCH_SIZE,
+        window: float = TRANSCRIPTION_BATCH_WINDOW,
+    ):
+        self._max_batch_size = max_batch_size
+        self._window = window
+        self._pending: List[
+            Tuple[Union[str, np.ndarray], str, Optional[str], asyncio.Future]
+        ] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+
+    async def submit(
+        self,
+        audio: Union[str, np.ndarray],
+        model_name: str,
+        language: Optional[str] = None,
+    ) -> dict:
+        """Queue an audio file or decoded 16kHz waveform for transcription and wait for its result."""
+        if isinstance(audio, str):
+            _check_audio_file(audio)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((audio, model_name, language, future))
+
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch))
+            # Keep a reference so the task is not garbage collected mid-flight
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(
+        self, batch: List[Tuple[Union[str, np.ndarray], str, Optional[str], asyncio.Future]]
+    ):
+        loop = asyncio.get_running_loop()
+        logger.info(f"Transcribing batch of {len(batch)} audio file(s)")
+
+        # Decode all audio files up front so ffmpeg never runs while the GPU waits;
+        # waveforms that are already decoded pass through unchanged
+        audios = await asyncio.gather(
+            *(
+                asyncio.to_thread(whisper.load_audio, audio)
+                if isinstance(audio, str)
+                else asyncio.sleep(0, audio)
+                for audio, _, _, _ in batch
+            ),
+            return_exceptions=True,
+        )
+        jobs = [
+            (audio, model_name, language, future)
+            for audio, (_, model_name, language, future) in zip(audios, batch)
+        ]
+
+        await loop.run_in_executor(self._executor, self._transcribe_batch, jobs, loop)
+
+    @staticmethod
+    def _transcribe_batch(
+        jobs: List[Tuple[Any, str, Optional[str], asyncio.Future]],
+        loop: asyncio.AbstractEventLoop,
+    ) -> None:
+        # Grouping by model avoids evicting and reloading models within a batch
+        for audio, model_name, language, future in sorted(jobs, key=lambda job: job[1]):
+            if isinstance(audio, BaseException):
+                result = RuntimeError(f"Failed to load audio: {audio}")
+            else:
+                try:
+                    result = transcribe_audio(audio, model_name, language)
+                except Exception as e:
+                    result = e
+            # Hand each result back as soon as it is ready, not at the end of the batch
+            loop.call_soon_threadsafe(_resolve_future, future, result)
+
+
+def _resolve_future(future: asyncio.Future, result: Any) -> None:
+    if future.done():
+        return
+    if isinstance(result, BaseException):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+
+transcription_batcher = TranscriptionBatcher()
 
 
 def extract_audio(video_path: str, audio_path: str) -> bool:
@@ -111,12 +365,56 @@ def extract_audio(video_path: str, audio_path: str) -> bool:
         raise RuntimeError(f"Failed to extract audio: {error_msg}")
 
 
-def download_video(video_url: str, output_path: str) -> None:
+def extract_audio_array(video_path: str) -> np.ndarray:
+    """
+    Decode the audio of a video straight into a 16kHz mono float32 waveform.
+
+    ffmpeg writes raw PCM to a pipe, so no intermediate audio file is encoded,
+    written and decoded again before Whisper sees it.
+    """
+    try:
+        logger.info(f"Extracting audio from {video_path}...")
+        result = subprocess.run(
+            [
+                "ffmpeg",
+                "-nostdin",
+                "-i", video_path,
+                "-vn",  # Disable video recording
+                "-f", "s16le",  # Raw 16-bit PCM
+                "-acodec", "pcm_s16le",
+                "-ar", str(whisper.audio.SAMPLE_RATE),  # Whisper's native rate
+                "-ac", "1",  # Mono audio
+                "-",
+            ],
+            check=True,
+            capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        error_msg = e.stderr.decode('utf-8') if e.stderr else str(e)
+        logger.error(f"Error extracting audio: {error_msg}")
+        raise RuntimeError(f"Failed to extract audio: {error_msg}")
+
+    audio = np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+    if audio.size < MIN_AUDIO_SAMPLES:
+        raise RuntimeError(f"Extracted audio is too short ({audio.size} samples), possibly no audio in video")
+
+    logger.info(f"Audio extracted successfully: {audio.size / whisper.audio.SAMPLE_RATE:.1f} s")
+    return audio
+
+
+def download_video(
+    video_url: str, output_path: str, info_json_path: Optional[str] = None
+) -> None:
     """
     Downloads the video from the given URL using yt-dlp and saves it to the specified path.
+
+    With info_json_path, yt-dlp loads metadata saved from an earlier lookup
+    instead of resolving the URL again; if that fails (the stream URLs in it
+    expire after a few hours) the download falls back to the URL.
     """
     try:
         logger.info(f"Downloading video from URL: {video_url}")
+        source = ["--load-info-json", info_json_path] if info_json_path else [video_url]
         # Work around YouTube's recent API restrictions by downloading video+audio separately and merging
         # Format: prefer H.264 or VP9 codecs (exclude AV1 which has compatibility issues)
         # Priority: H.264 ≤720p, then VP9 ≤720p, then any non-AV1 ≤720p, then fallback to best
@@ -127,7 +425,7 @@ def download_video(video_url: str, output_path: str) -> None:
                 "bestvideo[height<=720][vcodec^=avc]+bestaudio/bestvideo[height<=720][vcodec^=vp9]+bestaudio/bestvideo[height<=720][vcodec!=av01]+bestaudio/best[height<=720]/best",
                 "-o",
                 output_path,
-                video_url,
+                *source,
             ],
             check=True,
             capture_output=True,
@@ -141,16 +439,20 @@ def download_video(video_url: str, output_path: str) -> None:
             output_dir = os.path.dirname(output_path)
             output_basename = os.path.basename(output_path).split(".")[0]
 
-            # List all files in the temp directory that match our basename
-            matching_files = [
-                f for f in os.listdir(output_dir) if f.startswith(output_basename)
-            ]
+            # First file that matches our basename, skipping saved yt-dlp metadata
+            actual_file = next(
+                (
+                    path
+                    for path in Path(output_dir).glob(f"{output_basename}*")
+                    if not path.name.endswith(".info.json")
+                ),
+                None,
+            )
 
-            if matching_files:
-                actual_file = os.path.join(output_dir, matching_files[0])
+            if actual_file:
                 logger.info(f"Found downloaded file at: {actual_file}")
                 # Rename to our expected location
-                os.rename(actual_file, output_path)
+                actual_file.rename(output_path)
                 logger.info(f"Renamed to expected location: {output_path}")
             else:
                 logger.error(
@@ -162,6 +464,9 @@ def download_video(video_url: str, output_path: str) -> None:
         logger.info(f"Video downloaded successfully: {output_path}")
         return True
     except subprocess.CalledProcessError as e:
+        if info_json_path:
+            logger.warning(f"Download from saved metadata failed, resolving {video_url} again")
+            return download_video(video_url, output_path)
         logger.error(f"yt-dlp command failed with exit code {e.returncode}")
         logger.error(f"yt-dlp stderr: {e.stderr}")
         logger.error(f"yt-dlp stdout: {e.stdout}")
@@ -171,11 +476,9 @@ def download_video(video_url: str, output_path: str) -> None:
         raise RuntimeError(f"Failed to download video from {video_url}")
 
 
-def _process_audio_and_transcribe(
-    video_path: str, audio_path: str, model_name: str, language: str
-) -> Dict:
+def _extract_audio_or_raise(video_path: str, audio_path: str) -> None:
     """
-    Shared logic for audio extraction and transcription.
+    Shared audio extraction step for the request handlers.
     """
     is_audio_extracted = extract_audio(video_path, audio_path)
 
@@ -184,37 +487,44 @@ def _process_audio_and_transcribe(
         raise RuntimeError(f"Failed to extract audio from {video_path}")
     logger.info(f"Audio extracted successfully: {audio_path}")
 
-    transcription_result = transcribe_audio(audio_path, model_name, language)
-    logger.info(f"Transcribed video successfully.")
 
-    return transcription_result
+def _download_and_extract_audio(
+    video_url: str, video_path: str, audio_path: str
+) -> None:
+    is_video_downloaded = download_video(video_url, video_path)
+
+    if not is_video_downloaded:
+        logger.error(f"Failed to download video from {video_url}")
+        raise RuntimeError(f"Failed to download video from {video_url}")
+
+    logger.info(f"Video downloaded successfully: {video_path}")
+
+    _extract_audio_or_raise(video_path, audio_path)
 
 
-def process_video_from_url(
+async def process_video_from_url(
     video_url: str, video_path: str, audio_path: str, model_name: str, language: str
 ) -> Dict:
     """
     Process a video from URL by downloading, extracting audio, and transcribing.
     """
     try:
-        is_video_downloaded = download_video(video_url, video_path)
-
-        if not is_video_downloaded:
-            logger.error(f"Failed to download video from {video_url}")
-            raise RuntimeError(f"Failed to download video from {video_url}")
-
-        logger.info(f"Video downloaded successfully: {video_path}")
+        await asyncio.to_thread(
+            _download_and_extract_audio, video_url, video_path, audio_path
+        )
 
-        return _process_audio_and_transcribe(
-            video_path, audio_path, model_name, language
+        transcription_result = await transcription_batcher.submit(
+            audio_path, model_name, language
         )
+        logger.info(f"Transcribed video successfully.")
+        return transcription_result
 
     except Exception as e:
         logger.error(f"Error processing video from URL: {e}")
         raise e
 
 
-def process_video_from_file(
+async def process_video_from_file(
     video_path: str, audio_path: str, model_name: str, language: str
 ) -> Dict:
     """
@@ -223,9 +533,13 @@ def process_video_from_file(
     try:
         logger.info(f"Processing local video file: {video_path}")
 
-        return _process_audio_and_transcribe(
-            video_path, audio_path, model_name, language
+        await asyncio.to_thread(_extract_audio_or_raise, video_path, audio_path)
+
+        transcription_result = await transcription_batcher.submit(
+            audio_path, model_name, language
         )
+        logger.info(f"Transcribed video successfully.")
+        return transcription_result
 
     except Exception as e:
         logger.error(f"Error processing local video: {e}")
@@ -241,8 +555,7 @@ async def cleanup_file(file_path: str, delay: int = 3600) -> None:
     """
     try:
         await asyncio.sleep(delay)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if discard_file(file_path):
             logger.info(f"Deleted file: {file_path}")
         else:
             logger.warning(f"File not found for deletion: {file_path}")
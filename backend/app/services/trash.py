@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+import shutil
+from pathlib import Path
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+TRASH_DIR_NAME = ".trash"
+# Seconds between two passes of the trash reaper
+TRASH_REAP_INTERVAL = 60
+
+# Trash directories to empty; each sits beside the files moved into it
+_trash_dirs: set[Path] = set()
+
+
+def register_trash_dir(directory) -> None:
+    """
+    Track the .trash directory inside directory before anything is discarded there.
+
+    Files trashed by an earlier run that exited before the reaper emptied
+    them are then deleted on the first pass after startup.
+    """
+    _trash_dirs.add(Path(directory) / TRASH_DIR_NAME)
+
+
+def discard_file(file_path: str) -> bool:
+    """
+    Move a file or directory into a .trash directory beside it for the reaper to delete later.
+
+    A rename within the same directory tree is a single cheap metadata update,
+    unlike unlinking a large video on a slow or network-backed disk. Returns
+    False if the file does not exist.
+    """
+    source = Path(file_path)
+    trash_dir = source.parent / TRASH_DIR_NAME
+    if trash_dir not in _trash_dirs:
+        trash_dir.mkdir(exist_ok=True)
+        _trash_dirs.add(trash_dir)
+
+    try:
+        # Unique prefix so files with the same name never overwrite each other
+        os.replace(source, trash_dir / f"{uuid4().hex}_{source.name}")
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def empty_trash() -> int:
+    """Delete everything in the known trash directories and return the count."""
+    deleted = 0
+    for trash_dir in list(_trash_dirs):
+        try:
+            entries = list(os.scandir(trash_dir))
+        except FileNotFoundError:
+            _trash_dirs.discard(trash_dir)
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+                deleted += 1
+            except OSError as e:
+                logger.error(f"Error deleting trashed file {entry.path}: {e}")
+    return deleted
+
+
+async def reap_trash(interval: float = TRASH_REAP_INTERVAL) -> None:
+    """Empty the trash directories periodically until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        deleted = await asyncio.to_thread(empty_trash)
+        if deleted:
+            logger.info(f"Deleted {deleted} trashed file(s)")
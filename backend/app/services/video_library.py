@@ -1,44 +1,86 @@
-import json
 import logging
 import os
 import re
 import shutil
+import sqlite3
 import subprocess
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Optional
 from uuid import uuid4
 
+import orjson
+
 from app.models.video import (
     AddVideoResponse,
     ProcessingStatus,
     VideoMetadata,
     VideoSource,
 )
+from app.services.trash import discard_file, register_trash_dir
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
 DATA_DIR = Path("data")
+LIBRARY_DB = DATA_DIR / "library.db"
+# Libraries from before the SQLite store are imported from this file once
 LIBRARY_FILE = DATA_DIR / "video_library.json"
 VIDEOS_DIR = DATA_DIR / "videos"
 THUMBNAILS_DIR = DATA_DIR / "thumbnails"
 
 SUPPORTED_VIDEO_EXTENSIONS = {".mp4", ".mkv", ".avi", ".webm", ".mov", ".m4v"}
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB chunks when copying uploads to disk
+# Seconds a looked-up YouTube title is reused for the same URL
+YOUTUBE_TITLE_CACHE_TTL = 30 * 24 * 60 * 60
+DEFAULT_CONTENT_TYPE = "video/mp4"
+# Characters removed from YouTube titles so they are safe in filenames
+_UNSAFE_TITLE_CHARS_RE = re.compile(r'[<>:"/\\|?*]')
+# Columns of the videos table, in VideoMetadata field order
+VIDEO_COLUMNS = tuple(VideoMetadata.model_fields)
+# MIME types for SUPPORTED_VIDEO_EXTENSIONS
+VIDEO_CONTENT_TYPES = {
+    ".mp4": "video/mp4",
+    ".m4v": "video/mp4",
+    ".mkv": "video/x-matroska",
+    ".webm": "video/webm",
+    ".mov": "video/quicktime",
+    ".avi": "video/x-msvideo",
+}
+
+
+def youtube_info_path(video_id: str) -> Path:
+    """Where the yt-dlp metadata fetched when a YouTube video is added is kept until download."""
+    return VIDEOS_DIR / f"{video_id}.info.json"
+
+
+def guess_content_type(file_path: str) -> str:
+    """Guess the MIME type of a video file from its extension."""
+    extension = os.path.splitext(file_path)[1].lower()
+    return VIDEO_CONTENT_TYPES.get(extension, DEFAULT_CONTENT_TYPE)
 
 
 class VideoLibraryService:
     _instance = None
+    _instance_lock = threading.Lock()
     _videos: dict[str, VideoMetadata] = {}
+    # Videos indexed by status and by source, each in insertion order
+    _by_status: dict[ProcessingStatus, dict[str, VideoMetadata]] = {}
+    _by_source: dict[VideoSource, dict[str, VideoMetadata]] = {}
+    _library_db = None
+    # Guards the in-memory library together with its SQLite rows; reentrant
+    # because the mutators call the row helpers while holding it
+    _library_lock = threading.RLock()
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance._initialize()
+            # Videos are added from worker threads as well as the event loop
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance._initialize()
+                    cls._instance = instance
         return cls._instance
 
     def _initialize(self):
@@ -49,6 +91,9 @@ class VideoLibraryService:
         DATA_DIR.mkdir(exist_ok=True)
         VIDEOS_DIR.mkdir(exist_ok=True)
         THUMBNAILS_DIR.mkdir(exist_ok=True)
+        # Pick up files a previous run trashed but did not delete
+        for directory in (VIDEOS_DIR, THUMBNAILS_DIR, DATA_DIR / "frames"):
+            register_trash_dir(directory)
 
         # Load existing library
         self._load_library()
@@ -56,82 +101,173 @@ class VideoLibraryService:
         logger.info(f"Video Library initialized with {len(self._videos)} videos")
 
     def _load_library(self):
-        """Load the video library from JSON file."""
-        if LIBRARY_FILE.exists():
-            try:
-                with open(LIBRARY_FILE, "r") as f:
-                    data = json.load(f)
-                    for video_id, video_data in data.get("videos", {}).items():
-                        # Parse datetime strings
-                        if video_data.get("created_at"):
-                            video_data["created_at"] = datetime.fromisoformat(
-                                video_data["created_at"]
-                            )
-                        if video_data.get("completed_at"):
-                            video_data["completed_at"] = datetime.fromisoformat(
-                                video_data["completed_at"]
-                            )
-                        self._videos[video_id] = VideoMetadata(**video_data)
-                logger.info(f"Loaded {len(self._videos)} videos from library")
-            except Exception as e:
-                logger.error(f"Error loading video library: {e}")
-                self._videos = {}
-        else:
+        """
+        Load the video library from the SQLite store.
+
+        Every change is written to its own row, so the library is read once here
+        and kept in memory rather than rewritten as a whole on each update.
+        """
+        self._library_db = sqlite3.connect(LIBRARY_DB, check_same_thread=False)
+        with self._library_lock, self._library_db:
+            self._library_db.execute("PRAGMA journal_mode=WAL")
+            self._library_db.execute("PRAGMA synchronous=NORMAL")
+            self._library_db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS videos (
+                    id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    content_type TEXT,
+                    files_present INTEGER NOT NULL DEFAULT 0,
+                    youtube_url TEXT,
+                    duration REAL,
+                    thumbnail_path TEXT,
+                    whisper_model TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error_message TEXT,
+                    created_at TEXT NOT NULL,
+                    completed_at TEXT
+                )
+                """
+            )
+            # Titles by URL, so adding a URL again skips the yt-dlp lookup
+            self._library_db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS youtube_titles (
+                    url TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+                """
+            )
+            rows = self._library_db.execute(
+                f"SELECT {', '.join(VIDEO_COLUMNS)} FROM videos ORDER BY rowid"
+            ).fetchall()
+
+        self._videos = {}
+        try:
+            for row in rows:
+                video = VideoMetadata(**dict(zip(VIDEO_COLUMNS, row)))
+                self._videos[video.id] = video
+        except Exception as e:
+            logger.error(f"Error loading video library: {e}")
             self._videos = {}
 
-    def _save_library(self):
-        """Save the video library to JSON file."""
+        if not self._videos and LIBRARY_FILE.exists():
+            self._import_json_library()
+
+        for video in self._videos.values():
+            # Libraries saved before content types were stored
+            if not video.content_type:
+                video.content_type = guess_content_type(video.file_path)
+            if not video.files_present:
+                video.files_present = os.path.exists(video.file_path)
+
+        logger.info(f"Loaded {len(self._videos)} videos from library")
+        self._rebuild_indexes()
+
+    def _rebuild_indexes(self):
+        """Rebuild the status and source indexes from the loaded videos."""
+        self._by_status = {status: {} for status in ProcessingStatus}
+        self._by_source = {source: {} for source in VideoSource}
+        for video in self._videos.values():
+            self._index_video(video)
+
+    def _index_video(self, video: VideoMetadata):
+        self._by_status[video.status][video.id] = video
+        self._by_source[video.source][video.id] = video
+
+    def _unindex_video(self, video: VideoMetadata):
+        self._by_status[video.status].pop(video.id, None)
+        self._by_source[video.source].pop(video.id, None)
+
+    def _import_json_library(self):
+        """Import a library saved as JSON before the SQLite store existed."""
         try:
-            data = {"videos": {}}
-            for video_id, video in self._videos.items():
-                video_dict = video.model_dump()
-                # Convert datetime to ISO format strings
-                if video_dict.get("created_at"):
-                    video_dict["created_at"] = video_dict["created_at"].isoformat()
-                if video_dict.get("completed_at"):
-                    video_dict["completed_at"] = video_dict["completed_at"].isoformat()
-                data["videos"][video_id] = video_dict
-
-            with open(LIBRARY_FILE, "w") as f:
-                json.dump(data, f, indent=2)
-
-            logger.info(f"Saved {len(self._videos)} videos to library")
+            data = orjson.loads(LIBRARY_FILE.read_bytes())
+            videos = [
+                VideoMetadata(**video_data) for video_data in data.get("videos", {}).values()
+            ]
+            with self._library_lock, self._library_db:
+                self._library_db.executemany(
+                    f"INSERT OR REPLACE INTO videos ({', '.join(VIDEO_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(VIDEO_COLUMNS))})",
+                    [self._video_row(video) for video in videos],
+                )
+            # Keep the old file around, but never import it a second time
+            LIBRARY_FILE.rename(LIBRARY_FILE.with_suffix(".json.migrated"))
+            self._videos = {video.id: video for video in videos}
+            logger.info(f"Imported {len(videos)} videos from {LIBRARY_FILE}")
         except Exception as e:
-            logger.error(f"Error saving video library: {e}")
-            raise
+            logger.error(f"Error importing video library: {e}")
+
+    @staticmethod
+    def _video_row(video: VideoMetadata) -> tuple:
+        """Convert a video into a videos table row."""
+        data = video.model_dump(mode="json")
+        return tuple(data[column] for column in VIDEO_COLUMNS)
+
+    def _insert_video(self, video: VideoMetadata):
+        """Insert a new video into the SQLite store."""
+        with self._library_lock, self._library_db:
+            self._library_db.execute(
+                f"INSERT INTO videos ({', '.join(VIDEO_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(VIDEO_COLUMNS))})",
+                self._video_row(video),
+            )
+
+    def _update_video(self, video: VideoMetadata, *columns: str):
+        """Write the given columns of a video to its row in the SQLite store."""
+        data = video.model_dump(mode="json", include=set(columns))
+        with self._library_lock, self._library_db:
+            self._library_db.execute(
+                f"UPDATE videos SET {', '.join(f'{column} = ?' for column in columns)} "
+                "WHERE id = ?",
+                (*(data[column] for column in columns), video.id),
+            )
 
     def get_all_videos(self) -> list[VideoMetadata]:
         """Get all videos in the library."""
-        return list(self._videos.values())
+        with self._library_lock:
+            return list(self._videos.values())
 
     def get_video(self, video_id: str) -> Optional[VideoMetadata]:
         """Get a specific video by ID."""
         return self._videos.get(video_id)
 
+    def get_processing_count(self) -> int:
+        """Get the number of videos that are pending or processing."""
+        return len(self._by_status[ProcessingStatus.PENDING]) + len(
+            self._by_status[ProcessingStatus.PROCESSING]
+        )
+
     def get_videos_by_source(self) -> dict[str, list[VideoMetadata]]:
         """Get videos grouped by source (YouTube vs Uploaded)."""
-        grouped = {"YouTube": [], "Uploaded": []}
-        for video in self._videos.values():
-            if video.source == VideoSource.YOUTUBE:
-                grouped["YouTube"].append(video)
-            else:
-                grouped["Uploaded"].append(video)
-        return grouped
+        with self._library_lock:
+            return {
+                "YouTube": list(self._by_source[VideoSource.YOUTUBE].values()),
+                "Uploaded": list(self._by_source[VideoSource.UPLOADED].values()),
+            }
 
     def get_pending_videos(self) -> list[VideoMetadata]:
         """Get all videos with pending or processing status."""
-        return [
-            v
-            for v in self._videos.values()
-            if v.status in [ProcessingStatus.PENDING, ProcessingStatus.PROCESSING]
-        ]
+        with self._library_lock:
+            videos = [
+                *self._by_status[ProcessingStatus.PENDING].values(),
+                *self._by_status[ProcessingStatus.PROCESSING].values(),
+            ]
+        return sorted(videos, key=lambda video: video.created_at)
 
     def add_youtube_video(self, url: str, model: str = "base") -> AddVideoResponse:
         """Add a YouTube video to the library."""
         video_id = str(uuid4())
 
-        # Extract video title from URL using yt-dlp
-        title = self._get_youtube_title(url) or f"YouTube Video {video_id[:8]}"
+        # Extract video title from URL using yt-dlp, keeping its metadata for the download
+        title = (
+            self._get_youtube_title(url, youtube_info_path(video_id))
+            or f"YouTube Video {video_id[:8]}"
+        )
 
         # Create video metadata
         video = VideoMetadata(
@@ -139,14 +275,17 @@ class VideoLibraryService:
             title=title,
             source=VideoSource.YOUTUBE,
             file_path=str(VIDEOS_DIR / f"{video_id}.mp4"),
+            content_type=DEFAULT_CONTENT_TYPE,
             youtube_url=str(url),
             whisper_model=model,
             status=ProcessingStatus.PENDING,
             created_at=datetime.now(),
         )
 
-        self._videos[video_id] = video
-        self._save_library()
+        with self._library_lock:
+            self._videos[video_id] = video
+            self._index_video(video)
+            self._insert_video(video)
 
         logger.info(f"Added YouTube video to library: {title} ({video_id})")
 
@@ -157,9 +296,13 @@ class VideoLibraryService:
         )
 
     def add_uploaded_video(
-        self, filename: str, file_content: bytes, model: str = "base"
+        self, filename: str, file_obj: BinaryIO, model: str = "base"
     ) -> AddVideoResponse:
-        """Add an uploaded video file to the library."""
+        """
+        Add an uploaded video file to the library.
+
+        The upload is streamed to disk in chunks so it is never held in memory as a whole.
+        """
         video_id = str(uuid4())
 
         # Extract title from filename
@@ -173,7 +316,7 @@ class VideoLibraryService:
         # Save the video file
         file_path = VIDEOS_DIR / f"{video_id}{ext}"
         with open(file_path, "wb") as f:
-            f.write(file_content)
+            shutil.copyfileobj(file_obj, f, UPLOAD_CHUNK_SIZE)
 
         logger.info(f"Saved uploaded video to: {file_path}")
 
@@ -183,13 +326,17 @@ class VideoLibraryService:
             title=title,
             source=VideoSource.UPLOADED,
             file_path=str(file_path),
+            content_type=guess_content_type(str(file_path)),
+            files_present=True,
             whisper_model=model,
             status=ProcessingStatus.PENDING,
             created_at=datetime.now(),
         )
 
-        self._videos[video_id] = video
-        self._save_library()
+        with self._library_lock:
+            self._videos[video_id] = video
+            self._index_video(video)
+            self._insert_video(video)
 
         logger.info(f"Added uploaded video to library: {title} ({video_id})")
 
@@ -206,19 +353,21 @@ class VideoLibraryService:
         error_message: Optional[str] = None,
     ):
         """Update the processing status of a video."""
-        video = self._videos.get(video_id)
-        if not video:
-            logger.error(f"Video not found: {video_id}")
-            return
+        with self._library_lock:
+            video = self._videos.get(video_id)
+            if not video:
+                logger.error(f"Video not found: {video_id}")
+                return
 
-        video.status = status
-        video.error_message = error_message
+            self._by_status[video.status].pop(video_id, None)
+            self._by_status[status][video_id] = video
+            video.status = status
+            video.error_message = error_message
 
-        if status == ProcessingStatus.COMPLETED:
-            video.completed_at = datetime.now()
+            if status == ProcessingStatus.COMPLETED:
+                video.completed_at = datetime.now()
 
-        self._videos[video_id] = video
-        self._save_library()
+            self._update_video(video, "status", "error_message", "completed_at")
 
         logger.info(f"Updated video {video_id} status to {status}")
 
@@ -227,20 +376,23 @@ class VideoLibraryService:
         video_id: str,
         duration: Optional[float] = None,
         thumbnail_path: Optional[str] = None,
+        files_present: Optional[bool] = None,
     ):
         """Update video metadata after processing."""
-        video = self._videos.get(video_id)
-        if not video:
-            logger.error(f"Video not found: {video_id}")
-            return
+        with self._library_lock:
+            video = self._videos.get(video_id)
+            if not video:
+                logger.error(f"Video not found: {video_id}")
+                return
 
-        if duration is not None:
-            video.duration = duration
-        if thumbnail_path is not None:
-            video.thumbnail_path = thumbnail_path
+            if duration is not None:
+                video.duration = duration
+            if thumbnail_path is not None:
+                video.thumbnail_path = thumbnail_path
+            if files_present is not None:
+                video.files_present = files_present
 
-        self._videos[video_id] = video
-        self._save_library()
+            self._update_video(video, "duration", "thumbnail_path", "files_present")
 
     def delete_video(self, video_id: str) -> bool:
         """Delete a video from the library and clean up associated files."""
@@ -265,6 +417,9 @@ class VideoLibraryService:
             except Exception as e:
                 logger.error(f"Error deleting thumbnail: {e}")
 
+        # Metadata saved for a YouTube video that was never downloaded
+        discard_file(str(youtube_info_path(video_id)))
+
         # Delete frames directory
         frames_dir = DATA_DIR / "frames" / video_id
         if frames_dir.exists():
@@ -275,14 +430,23 @@ class VideoLibraryService:
                 logger.error(f"Error deleting frames directory: {e}")
 
         # Remove from library
-        del self._videos[video_id]
-        self._save_library()
+        with self._library_lock, self._library_db:
+            if self._videos.pop(video_id, None) is not None:
+                self._unindex_video(video)
+            self._library_db.execute("DELETE FROM videos WHERE id = ?", (video_id,))
 
         logger.info(f"Deleted video from library: {video_id}")
         return True
 
-    def generate_thumbnail(self, video_id: str) -> Optional[str]:
-        """Generate a thumbnail for a video."""
+    def generate_thumbnail(
+        self, video_id: str, duration: Optional[float] = None
+    ) -> Optional[str]:
+        """
+        Generate a thumbnail for a video.
+
+        Pass the duration when it is already known; otherwise the stored one is
+        used, and ffprobe only runs for videos without a recorded duration.
+        """
         video = self._videos.get(video_id)
         if not video or not video.file_path:
             return None
@@ -295,17 +459,20 @@ class VideoLibraryService:
 
         try:
             # Get video duration first
-            duration = self.get_video_duration(video.file_path)
+            if duration is None:
+                duration = video.duration or self.get_video_duration(video.file_path)
             # Capture frame at 10% of the video duration
             timestamp = duration * 0.1 if duration else 5
 
             subprocess.run(
                 [
                     "ffmpeg",
-                    "-i",
-                    video.file_path,
+                    # Seek on the input so ffmpeg jumps to the nearest keyframe
+                    # instead of decoding everything before the timestamp
                     "-ss",
                     str(timestamp),
+                    "-i",
+                    video.file_path,
                     "-vframes",
                     "1",
                     "-vf",
@@ -351,63 +518,87 @@ class VideoLibraryService:
             logger.error(f"Error getting video duration: {e}")
             return None
 
-    def _get_youtube_title(self, url: str) -> Optional[str]:
-        """Get the title of a YouTube video using yt-dlp."""
+    def _get_youtube_title(
+        self, url: str, info_path: Optional[Path] = None
+    ) -> Optional[str]:
+        """
+        Get the title of a YouTube video using yt-dlp.
+
+        With info_path, the full metadata is saved there so the later download
+        can load it instead of resolving the URL a second time. Titles are
+        cached by URL for YOUTUBE_TITLE_CACHE_TTL; a cached title saves no
+        metadata, and the download resolves the URL itself.
+        """
+        with self._library_lock:
+            cached = self._library_db.execute(
+                "SELECT title FROM youtube_titles WHERE url = ? AND fetched_at > ?",
+                (url, time.time() - YOUTUBE_TITLE_CACHE_TTL),
+            ).fetchone()
+        if cached:
+            return cached[0]
+
         try:
             result = subprocess.run(
-                ["yt-dlp", "--get-title", url],
+                ["yt-dlp", "--dump-single-json", url],
                 capture_output=True,
-                text=True,
                 check=True,
                 timeout=30,
             )
-            title = result.stdout.strip()
+            info = orjson.loads(result.stdout)
+            # A playlist URL resolves to many videos and is downloaded from the URL
+            if info_path is not None and info.get("_type", "video") == "video":
+                info_path.write_bytes(result.stdout)
+            title = (info.get("title") or "").strip()
             # Sanitize title for use as filename
-            title = re.sub(r'[<>:"/\\|?*]', "", title)
-            return title[:100] if title else None  # Limit title length
+            title = _UNSAFE_TITLE_CHARS_RE.sub("", title)[:100]  # Limit title length
+            if not title:
+                return None
+
+            with self._library_lock, self._library_db:
+                self._library_db.execute(
+                    "INSERT OR REPLACE INTO youtube_titles (url, title, fetched_at) "
+                    "VALUES (?, ?, ?)",
+                    (url, title, time.time()),
+                )
+            return title
         except Exception as e:
             logger.error(f"Error getting YouTube title: {e}")
             return None
 
     def video_file_exists(self, video_id: str) -> bool:
-        """Check if the video file exists on disk."""
+        """Check if the video file has been stored on disk."""
         video = self._videos.get(video_id)
-        if not video or not video.file_path:
-            return False
-        return os.path.exists(video.file_path)
+        return bool(video and video.files_present)
 
     def clear_library(self) -> dict:
         """Clear all videos from the library and clean up all associated files."""
-        video_ids = list(self._videos.keys())
+        # Clear the in-memory library first, then clean up files of the removed videos
+        with self._library_lock, self._library_db:
+            videos, self._videos = self._videos, {}
+            self._rebuild_indexes()
+            self._library_db.execute("DELETE FROM videos")
+
         deleted_count = 0
         errors = []
 
-        for video_id in video_ids:
+        # Files are moved to the trash with one rename each rather than unlinked;
+        # the trash reaper deletes them off the request path
+        for video_id, video in videos.items():
             try:
-                video = self._videos.get(video_id)
-                if video:
-                    # Delete video file
-                    if video.file_path and os.path.exists(video.file_path):
-                        os.remove(video.file_path)
-
-                    # Delete thumbnail
-                    if video.thumbnail_path and os.path.exists(video.thumbnail_path):
-                        os.remove(video.thumbnail_path)
-
-                    # Delete frames directory
-                    frames_dir = DATA_DIR / "frames" / video_id
-                    if frames_dir.exists():
-                        shutil.rmtree(frames_dir)
+                if video.file_path:
+                    discard_file(video.file_path)
+                if video.thumbnail_path:
+                    discard_file(video.thumbnail_path)
+                discard_file(str(youtube_info_path(video_id)))
+                frames_dir = DATA_DIR / "frames" / video_id
+                if frames_dir.exists():
+                    discard_file(str(frames_dir))
 
                 deleted_count += 1
             except Exception as e:
                 logger.error(f"Error cleaning up video {video_id}: {e}")
                 errors.append({"video_id": video_id, "error": str(e)})
 
-        # Clear in-memory library
-        self._videos = {}
-        self._save_library()
-
         logger.info(f"Cleared library: {deleted_count} videos deleted")
         return {"deleted_count": deleted_count, "errors": errors}
 
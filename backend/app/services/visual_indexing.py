@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from typing import List
+
+from app.models.transcription import TranscriptSegment
+from app.services.search import search_service
+from app.services.visual_processing import visual_processing_service
+
+logger = logging.getLogger(__name__)
+
+
+async def index_video_frames(
+    video_id: str,
+    video_path: str,
+    segments: List[TranscriptSegment],
+    frames_per_second: float = 0.5,  # Default: extract 1 frame every 2 seconds
+) -> bool:
+    """
+    Extract, embed and index the frames of a video's transcript segments.
+
+    Shared by the transcription routes and the background processor. Failures
+    are logged and reported as False rather than raised, since the transcript
+    is still usable without visual search.
+    """
+    try:
+        logger.info(f"Starting visual processing for video {video_id}")
+
+        # Extract frames and embed them batch by batch as they are decoded
+        frame_data_with_embeddings = (
+            await visual_processing_service.extract_and_embed_frames(
+                video_path, segments, frames_per_second
+            )
+        )
+
+        if not frame_data_with_embeddings:
+            logger.warning(f"No frames extracted for video {video_id}")
+            return False
+
+        # Index visual embeddings
+        await asyncio.to_thread(
+            search_service.index_visual_embeddings,
+            video_id,
+            frame_data_with_embeddings,
+        )
+        logger.info(f"Visual processing completed for video {video_id}")
+        return True
+
+    except Exception as e:
+        logger.error(f"Error during visual processing for {video_id}: {e}")
+        return False
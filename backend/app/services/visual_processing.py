@@ -1,23 +1,46 @@
-import cv2
+import asyncio
+import functools
 import logging
+import multiprocessing
+import numpy as np
 import os
 import shutil
+import sys
+import threading
 import torch
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
 from PIL import Image
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from transformers import AutoModel, AutoProcessor
+
+try:
+    from torchvision.io import ImageReadMode, decode_jpeg, read_file
+except ImportError:  # torchvision is optional; frames are then decoded with PIL
+    decode_jpeg = None
 from app.models.transcription import TranscriptSegment
+from app.services.frame_extraction import extract_frames, iter_frames
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 logger = logging.getLogger(__name__)
 
+# Frames per SigLIP forward pass
+FRAME_EMBEDDING_BATCH_SIZE = int(os.getenv("FRAME_EMBEDDING_BATCH_SIZE", "32"))
+# Decoded frame batches buffered between extraction and embedding
+FRAME_BATCH_QUEUE_SIZE = 4
+# Worker processes decoding frames, and segments handed to each decode task
+FRAME_DECODE_PROCESSES = int(
+    os.getenv("FRAME_DECODE_PROCESSES", str(max(2, (os.cpu_count() or 2) // 2)))
+)
+SEGMENTS_PER_DECODE_TASK = 16
+# Replay frame embedding from a captured CUDA graph instead of launching kernels per batch
+FRAME_EMBEDDING_CUDA_GRAPHS = os.getenv("FRAME_EMBEDDING_CUDA_GRAPHS", "true").lower() == "true"
+# Text query embeddings kept for repeated visual searches (~3 KB each)
+TEXT_EMBEDDING_CACHE_SIZE = 1024
+
 
 class VisualProcessingService:
     """
@@ -29,9 +52,39 @@ class VisualProcessingService:
         self._model = None
         self._processor = None
         self._device = None
+        # Processor rescale/mean/std as device tensors for GPU-side normalization
+        self._pixel_norm: Optional[Tuple[float, Any, Any]] = None
+        # (graph, static input, static output) per captured batch shape
+        self._frame_graphs: Dict[Tuple[int, ...], Tuple[Any, Any, Any]] = {}
+        # Query text embeddings cached per instance, keyed on the lowercased text
+        self._embed_query_text = functools.lru_cache(maxsize=TEXT_EMBEDDING_CACHE_SIZE)(
+            self._compute_text_embedding
+        )
         self._frame_output_dir = Path("data/frames")
         self._frame_output_dir.mkdir(parents=True, exist_ok=True)
 
+        # Separate pools so frame decoding never queues behind model inference.
+        # The single GPU worker is the only thread that runs or replays the
+        # frame graphs, so captured static buffers are never shared.
+        self._decode_executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="frame-decode"
+        )
+        self._gpu_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="gpu"
+        )
+        # The per-frame Python work around OpenCV contends for the GIL, so chunks
+        # are decoded in separate processes. Workers are started lazily, when
+        # this process already runs threads and holds torch/CUDA state, so they
+        # come from a fork server that only preloads the torch-free
+        # frame_extraction module. Other platforms decode on the calling thread.
+        self._process_executor = None
+        if sys.platform.startswith("linux") and FRAME_DECODE_PROCESSES > 1:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["app.services.frame_extraction"])
+            self._process_executor = ProcessPoolExecutor(
+                max_workers=FRAME_DECODE_PROCESSES, mp_context=context
+            )
+
         # Load model on initialization
         self._load_model()
 
@@ -56,6 +109,26 @@ class VisualProcessingService:
 
             logger.info(f"SigLIP2 model loaded successfully on {self._device}.")
 
+    async def warm_up(self) -> None:
+        """
+        Run a text query and one full frame batch through SigLIP on the GPU worker,
+        so kernels are initialized and the frame CUDA graph is captured before
+        the first real request.
+        """
+
+        def run():
+            self._load_model()
+            self.generate_text_embedding("warm up")
+            image_size, _ = self._model_image_spec()
+            if image_size is not None:
+                images = [Image.new("RGB", image_size)] * FRAME_EMBEDDING_BATCH_SIZE
+                self.embed_pixel_values(
+                    self.preprocess_frames(images), FRAME_EMBEDDING_BATCH_SIZE
+                )
+
+        await asyncio.get_running_loop().run_in_executor(self._gpu_executor, run)
+        logger.info("Warmed up SigLIP2 model.")
+
     def extract_frames_for_segments(
         self,
         video_path: str,
@@ -63,150 +136,340 @@ class VisualProcessingService:
         frames_per_second: float = 0.5,  # Default: extract 1 frame every 2 seconds
     ) -> Dict[str, List[Dict[str, Any]]]:
         """Extract frames from video for given transcript segments."""
+        return dict(self.iter_segment_frames(video_path, segments, frames_per_second))
 
-        logger.info(f"Starting frame extraction from video: {video_path}")
-        logger.info(f"Number of segments to process: {len(segments)}")
-
-        # Check if video file exists
-        if not os.path.exists(video_path):
-            logger.error(f"Video file not found: {video_path}")
-            return {}
-
-        cap = cv2.VideoCapture(video_path)
+    def iter_frame_batches(
+        self,
+        video_path: str,
+        segments: List[TranscriptSegment],
+        frames_per_second: float = 0.5,
+        batch_size: int = FRAME_EMBEDDING_BATCH_SIZE,
+        keep_images: bool = False,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Extract frames for the given segments and yield them in batches of batch_size."""
+        batch = []
+        for _, segment_frames in self.iter_segment_frames(
+            video_path, segments, frames_per_second, keep_images
+        ):
+            batch.extend(segment_frames)
+            while len(batch) >= batch_size:
+                yield batch[:batch_size]
+                batch = batch[batch_size:]
+        if batch:
+            yield batch
+
+    def iter_segment_frames(
+        self,
+        video_path: str,
+        segments: List[TranscriptSegment],
+        frames_per_second: float = 0.5,
+        keep_images: bool = False,
+    ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Extract frames from video segment by segment, yielding (segment_id, frames).
 
-        # Check if video opened successfully
-        if not cap.isOpened():
-            logger.error(f"Failed to open video: {video_path}")
-            return {}
+        Segments are split into chunks that are decoded in parallel worker
+        processes; results are yielded in segment order. With keep_images, each
+        frame dict also carries the RGB image at the model's input size under
+        "image" so it can be embedded without reading the JPEG back from disk.
+        """
+        spans = [(segment.id, segment.start, segment.end) for segment in segments]
+        chunks = [
+            spans[i : i + SEGMENTS_PER_DECODE_TASK]
+            for i in range(0, len(spans), SEGMENTS_PER_DECODE_TASK)
+        ]
+        image_size, resample = (
+            self._model_image_spec() if keep_images else (None, Image.BICUBIC)
+        )
+        args = (
+            frames_per_second,
+            str(self._frame_output_dir),
+            keep_images,
+            image_size,
+            resample,
+        )
+
+        # Small videos are not worth the round trip to a worker process
+        if self._process_executor is None or len(chunks) <= 1:
+            yield from iter_frames(video_path, spans, *args)
+            return
+
+        # Keep a bounded number of chunks in flight so memory stays flat
+        chunk_iter = iter(chunks)
+        pending = deque(
+            self._process_executor.submit(extract_frames, video_path, chunk, *args)
+            for chunk in islice(chunk_iter, FRAME_DECODE_PROCESSES * 2)
+        )
+        try:
+            while pending:
+                results = pending.popleft().result()
+                for chunk in islice(chunk_iter, 1):
+                    pending.append(
+                        self._process_executor.submit(extract_frames, video_path, chunk, *args)
+                    )
+                yield from results
+        finally:
+            for future in pending:
+                future.cancel()
 
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        logger.info(f"Video FPS: {fps}, Total frames: {total_frames}")
+    def _model_image_spec(self) -> Tuple[Optional[Tuple[int, int]], int]:
+        """Return the processor's fixed (width, height) input size and resample filter."""
+        self._load_model()
 
-        video_id = Path(video_path).stem
-        video_frame_dir = self._frame_output_dir / video_id
-        video_frame_dir.mkdir(exist_ok=True, parents=True)
-        logger.info(f"Frame output directory: {video_frame_dir}")
+        image_processor = getattr(self._processor, "image_processor", None)
+        size = getattr(image_processor, "size", None) or {}
+        resample = int(getattr(image_processor, "resample", Image.BICUBIC))
+        if "height" not in size or "width" not in size:
+            return None, resample
+        return (size["width"], size["height"]), resample
 
-        frames_by_segment = {}
-        total_frames_extracted = 0
-        try:
+    async def extract_and_embed_frames(
+        self,
+        video_path: str,
+        segments: List[TranscriptSegment],
+        frames_per_second: float = 0.5,
+        batch_size: int = FRAME_EMBEDDING_BATCH_SIZE,
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Extract frames and generate their embeddings, overlapping the two stages.
 
-            for segment in segments:
-                segment_frames = []
-
-                # Calculate frame extraction times within this segment
-                start_time = segment.start
-                end_time = segment.end
-                interval = 1.0 / frames_per_second
-
-                # Extract frames at regular intervals within the segment
-                current_time = start_time
-                while current_time <= end_time:
-                    # Seek to the specific timestamp in the video
-                    frame_number = int(current_time * fps)
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-
-                    ret, frame = cap.read()
-                    if ret:
-                        # Save the frame to disk
-                        frame_filename = f"frame_{current_time:.2f}.jpg"
-                        frame_path = video_frame_dir / frame_filename
-                        success = cv2.imwrite(str(frame_path), frame)
-
-                        if success:
-                            segment_frames.append(
-                                {
-                                    "timestamp": current_time,
-                                    "path": str(frame_path),
-                                    "segment_id": segment.id,
-                                }
-                            )
-                            total_frames_extracted += 1
-                        else:
-                            logger.error(
-                                f"Failed to save frame at {current_time:.2f}s to {frame_path}"
-                            )
-                    else:
-                        logger.warning(
-                            f"Failed to read frame at {current_time:.2f}s (frame {frame_number})"
-                        )
-
-                    current_time += interval
-
-                # Also extract frame at segment end if not already included
-                if (
-                    len(segment_frames) == 0
-                    or segment_frames[-1]["timestamp"] < end_time
+        A producer thread decodes and preprocesses frames and hands batches to the
+        consumer through a bounded queue, so one batch is embedded while the next
+        is being decoded. Decoded frames go to the model in memory; the JPEGs are
+        only written for serving. Returns frames grouped by segment ID, each with timestamp, path and embedding.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=FRAME_BATCH_QUEUE_SIZE)
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for batch in self.iter_frame_batches(
+                    video_path, segments, frames_per_second, batch_size, keep_images=True
                 ):
-                    frame_number = int(end_time * fps)
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-                    ret, frame = cap.read()
-                    if ret:
-                        frame_filename = f"frame_{end_time:.2f}.jpg"
-                        frame_path = video_frame_dir / frame_filename
-                        cv2.imwrite(str(frame_path), frame)
-                        segment_frames.append(
-                            {
-                                "timestamp": end_time,
-                                "path": str(frame_path),
-                                "segment_id": segment.id,
-                            }
-                        )
-
-                frames_by_segment[segment.id] = segment_frames
-                logger.info(
-                    f"Extracted {len(segment_frames)} frames for segment {segment.id} ({segment.start:.2f}s to {segment.end:.2f}s)"
+                    if stop.is_set():
+                        break
+                    # Only the preprocessed tensor is queued, not the full-size images
+                    pixel_values = self.preprocess_frames(
+                        [frame.pop("image") for frame in batch]
+                    )
+                    asyncio.run_coroutine_threadsafe(
+                        queue.put((batch, pixel_values)), loop
+                    ).result()
+            finally:
+                # Sentinel marks the end of the stream, also after a failure
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+        producer = loop.run_in_executor(self._decode_executor, produce)
+
+        frame_data: Dict[str, List[Dict[str, Any]]] = {}
+        try:
+            while (item := await queue.get()) is not None:
+                batch, pixel_values = item
+                embeddings = await loop.run_in_executor(
+                    self._gpu_executor,
+                    self.embed_pixel_values,
+                    pixel_values,
+                    batch_size,
                 )
-
+                # Each embedding is a row view into the batch array
+                for frame, embedding in zip(batch, embeddings):
+                    frame_data.setdefault(frame["segment_id"], []).append(
+                        {
+                            "timestamp": frame["timestamp"],
+                            "path": frame["path"],
+                            "embedding": embedding,
+                        }
+                    )
+        except BaseException:
+            # Stop the producer and drain the queue so it is not left blocked on put()
+            stop.set()
+            while await queue.get() is not None:
+                pass
+            raise
         finally:
-            cap.release()
-            logger.info(
-                f"Frame extraction complete. Total frames extracted: {total_frames_extracted}"
-            )
-            logger.info(f"Segments with frames: {len(frames_by_segment)}")
+            await producer
 
-        return frames_by_segment
+        logger.info(
+            f"Embedded {sum(len(frames) for frames in frame_data.values())} frames from {video_path}"
+        )
+        return frame_data
 
-    def generate_frame_embeddings(self, frame_paths: List[str]) -> List[List[float]]:
-        """Generate SigLIP embeddings for a list of frame images."""
+    def generate_frame_embeddings(
+        self, frame_paths: List[str], batch_size: int = FRAME_EMBEDDING_BATCH_SIZE
+    ) -> np.ndarray:
+        """
+        Generate SigLIP embeddings for a list of frame images as an (N, D) array.
+
+        Frames are stacked into batches of batch_size and embedded with one
+        forward pass per batch; on CUDA the JPEGs are decoded with NVJPEG, and
+        the pass runs in float16 autocast replayed from a captured CUDA graph.
+        Call from the GPU executor only.
+        """
 
         self._load_model()
 
-        embeddings = []
+        # On CUDA, JPEGs are decoded, resized and normalized on the GPU (NVJPEG)
+        image_size, _ = self._model_image_spec()
+        decode_on_gpu = (
+            self._device == "cuda" and decode_jpeg is not None and image_size is not None
+        )
 
-        # Process frames in batches for efficiency
-        batch_size = 8
+        batches = []
         for i in range(0, len(frame_paths), batch_size):
             batch_paths = frame_paths[i : i + batch_size]
+            if decode_on_gpu:
+                pixel_values = self._decode_frames_on_gpu(batch_paths, image_size)
+            else:
+                images = [Image.open(path).convert("RGB") for path in batch_paths]
+                pixel_values = self.preprocess_frames(images)
+            batches.append(self.embed_pixel_values(pixel_values, batch_size))
+
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(batches)
+
+    def _decode_frames_on_gpu(
+        self, frame_paths: List[str], image_size: Tuple[int, int]
+    ) -> torch.Tensor:
+        """Decode JPEG frames with NVJPEG and apply the processor's resize and normalization."""
+        if self._pixel_norm is None:
+            image_processor = self._processor.image_processor
+            shape = (1, 3, 1, 1)
+            self._pixel_norm = (
+                image_processor.rescale_factor,
+                torch.tensor(image_processor.image_mean, device=self._device).view(shape),
+                torch.tensor(image_processor.image_std, device=self._device).view(shape),
+            )
+        rescale_factor, mean, std = self._pixel_norm
+
+        width, height = image_size
+        images = decode_jpeg(
+            [read_file(path) for path in frame_paths],
+            mode=ImageReadMode.RGB,
+            device=self._device,
+        )
+        pixel_values = torch.cat(
+            [
+                torch.nn.functional.interpolate(
+                    image.unsqueeze(0).float(),
+                    size=(height, width),
+                    mode="bicubic",
+                    antialias=True,
+                    align_corners=False,
+                )
+                for image in images
+            ]
+        )
+        # Bicubic overshoots like PIL's would be clipped to the uint8 range
+        return pixel_values.clamp_(0, 255).mul_(rescale_factor).sub_(mean).div_(std)
+
+    def preprocess_frames(self, images: List[Image.Image]) -> torch.Tensor:
+        """Convert RGB images to the model's pixel values, pinned on CUDA hosts."""
+        self._load_model()
 
-            images = []
-            for path in batch_paths:
-                image = Image.open(path).convert("RGB")
-                images.append(image)
+        pixel_values = self._processor(images=images, return_tensors="pt")["pixel_values"]
+        if self._device == "cuda":
+            # Pinned memory allows the host-to-device copy to run asynchronously
+            pixel_values = pixel_values.pin_memory()
+        return pixel_values
 
-            with torch.no_grad():
-                inputs = self._processor(images=images, return_tensors="pt").to(
-                    self._device
-                )
-                outputs = self._model.get_image_features(**inputs)
+    def embed_pixel_values(
+        self, pixel_values: torch.Tensor, batch_size: int = FRAME_EMBEDDING_BATCH_SIZE
+    ) -> np.ndarray:
+        """
+        Embed one preprocessed batch of frames into an (N, D) float32 array.
 
-                # Normalize embeddings
-                batch_embeddings = outputs / outputs.norm(dim=-1, keepdim=True)
-                embeddings.extend(batch_embeddings.cpu().numpy().tolist())
+        Call from the GPU executor only.
+        """
+        self._load_model()
+
+        use_cuda = self._device == "cuda"
+        pixel_values = pixel_values.to(self._device, non_blocking=use_cuda)
+
+        if use_cuda and FRAME_EMBEDDING_CUDA_GRAPHS:
+            batch_embeddings = self._embed_with_cuda_graph(pixel_values, batch_size)
+        else:
+            batch_embeddings = self._forward_frames(pixel_values)
+
+        # Kept as an array; per-frame Python float lists are never materialized
+        return batch_embeddings.float().cpu().numpy()
+
+    def _forward_frames(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Run the image encoder and return normalized embeddings."""
+        use_cuda = self._device == "cuda"
+        # Autocast's weight cache must be off for passes captured into a CUDA graph
+        with torch.inference_mode(), torch.autocast(
+            device_type="cuda",
+            dtype=torch.float16,
+            enabled=use_cuda,
+            cache_enabled=False,
+        ):
+            outputs = self._model.get_image_features(pixel_values=pixel_values)
+
+            # Normalize embeddings
+            return outputs / outputs.norm(dim=-1, keepdim=True)
+
+    def _embed_with_cuda_graph(
+        self, pixel_values: torch.Tensor, batch_size: int
+    ) -> torch.Tensor:
+        """
+        Embed a batch by replaying a CUDA graph captured for a fixed batch shape.
 
-        return embeddings
+        Partial batches are zero-padded to batch_size so every video reuses the
+        same graph. Falls back to an eager forward pass if capture fails.
+        """
+        count = pixel_values.shape[0]
+        if count < batch_size:
+            padding = pixel_values.new_zeros((batch_size - count, *pixel_values.shape[1:]))
+            pixel_values = torch.cat([pixel_values, padding])
+
+        shape = tuple(pixel_values.shape)
+        if shape not in self._frame_graphs:
+            try:
+                self._frame_graphs[shape] = self._capture_frame_graph(pixel_values)
+            except RuntimeError as e:
+                logger.warning(f"CUDA graph capture failed, using eager embedding: {e}")
+                return self._forward_frames(pixel_values[:count])
+
+        graph, static_input, static_output = self._frame_graphs[shape]
+        static_input.copy_(pixel_values)
+        graph.replay()
+        # The static output is overwritten by the next replay
+        return static_output[:count].clone()
+
+    def _capture_frame_graph(self, example: torch.Tensor) -> Tuple[Any, Any, Any]:
+        """Warm up the image encoder on a side stream and capture one forward pass."""
+        logger.info(f"Capturing CUDA graph for frame batch shape {tuple(example.shape)}")
+        static_input = torch.empty_like(example)
+        static_input.copy_(example)
+
+        # Warm-up iterations must run on a side stream before capture
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(3):
+                self._forward_frames(static_input)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_output = self._forward_frames(static_input)
+
+        return graph, static_input, static_output
 
     def generate_text_embedding(self, text: str) -> List[float]:
         """Generate SigLIP2 embedding for a text query.
         This allows search over images using text queries.
         """
+        # Convert to lowercase as recommended; repeated queries hit the cache
+        return list(self._embed_query_text(text.lower()))
+
+    def _compute_text_embedding(self, text_lower: str) -> Tuple[float, ...]:
         self._load_model()
 
         with torch.no_grad():
             # SigLIP2 uses specific formatting and parameters
-            # Convert to lowercase as recommended
-            text_lower = text.lower()
             # Use prompt template for better results
             formatted_text = f"This is a photo of {text_lower}."
 
@@ -222,7 +485,8 @@ class VisualProcessingService:
             # Normalize embedding
             text_embedding = outputs / outputs.norm(dim=-1, keepdim=True)
 
-        return text_embedding[0].cpu().numpy().tolist()
+        # A tuple so callers can't modify the cached embedding
+        return tuple(text_embedding[0].cpu().numpy().tolist())
 
     def cleanup_frames(self, video_id: str):
         """Cleanup extracted frames for a specific video."""